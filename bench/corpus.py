@@ -0,0 +1,233 @@
+import collections
+import concurrent.futures
+import io
+import os
+import random
+import time
+import zipfile
+from xml.sax.saxutils import escape
+
+CHUNK_SIZE = 1000
+COPY_RATIO = 0.05
+DUPLICATE_RATIO = 0.02
+MAX_AGE_DAYS = 3 * 365
+LARGE_BINARY_RATIO = 0.005
+
+WORDS = ['invoice', 'report', 'budget', 'notes', 'resume', 'project', 'lecture', 'homework', 'receipt', 'photo',
+         'draft', 'meeting', 'taxes', 'contract', 'summary', 'dataset', 'backup', 'travel', 'syllabus', 'thesis',
+         'statement', 'schedule', 'proposal', 'slides', 'assignment', 'transcript', 'lease', 'insurance', 'results',
+         'analysis', 'final', 'review', 'agenda', 'minutes', 'roadmap', 'survey', 'grades', 'payroll', 'ticket']
+INSTALLER_NAMES = ['setup', 'installer', 'update', 'x64', 'win64']
+
+# Relative frequency of each file type in a typical Downloads folder
+FILE_TYPES = {
+    '.pdf': 18, '.docx': 8, '.xlsx': 5, '.csv': 6, '.json': 4, '.txt': 6, '.md': 2, '.py': 3, '.js': 2,
+    '.html': 2, '.sql': 1, '.png': 12, '.jpg': 10, '.zip': 8, '.exe': 6, '.msi': 2, '.mp4': 3, '.bin': 2,
+}
+
+CODE_TEMPLATES = {
+    '.py': 'def {0}_{1}(values):\n    return [value * {2} for value in values]\n\n',
+    '.js': 'function {0}{1}(values) {{\n  return values.map(value => value * {2});\n}}\n\n',
+    '.html': '<section id="{0}"><h2>{1}</h2><p>{2}</p></section>\n',
+    '.sql': 'SELECT {0}, {1} FROM records WHERE total > {2};\n',
+}
+
+
+# Writes a synthetic Downloads folder with a realistic mix of documents, spreadsheets, data, code and binaries.
+# Every file is derived from (seed, index) alone, so the corpus is identical between runs and can be generated in
+# parallel. A share of the files get "name (1).ext" copies or are downloaded again under another name, which is
+# what duplicate detection and the deletion rules look for.
+def generate_corpus(folder_path: str, num_files: int, seed: int = 0, copy_ratio: float = COPY_RATIO,
+                    duplicate_ratio: float = DUPLICATE_RATIO, max_workers: int | None = None) -> dict:
+    os.makedirs(folder_path, exist_ok=True)
+
+    start_time = time.perf_counter()
+    manifest = collections.Counter()
+
+    starts = range(0, num_files, CHUNK_SIZE)
+    with concurrent.futures.ProcessPoolExecutor(max_workers) as pool:
+        for chunk_manifest in pool.map(_write_chunk, *zip(*[(folder_path, start, min(start + CHUNK_SIZE, num_files),
+                                                             seed, copy_ratio, duplicate_ratio)
+                                                            for start in starts])):
+            manifest.update(chunk_manifest)
+
+    return {**manifest, 'seconds': time.perf_counter() - start_time}
+
+
+def _write_chunk(folder_path, start, end, seed, copy_ratio, duplicate_ratio) -> collections.Counter:
+    manifest = collections.Counter()
+    now = time.time()
+
+    for i in range(start, end):
+        rng = random.Random(f'{seed}-{i}')
+
+        file_type = rng.choices(list(FILE_TYPES), weights=list(FILE_TYPES.values()))[0]
+        name = _make_name(rng, file_type, i)
+        content = _make_content(rng, file_type, name)
+        mtime = now - rng.uniform(0, MAX_AGE_DAYS * 86400)
+
+        paths = [os.path.join(folder_path, f'{name}{file_type}')]
+        if rng.random() < copy_ratio:
+            paths += [os.path.join(folder_path, f'{name} ({n}){file_type}') for n in range(1, rng.choice([2, 2, 3]))]
+        if rng.random() < duplicate_ratio:
+            paths.append(os.path.join(folder_path, f'{name}-{rng.choice(WORDS)}{file_type}'))
+
+        for path in paths:
+            with open(path, 'wb') as f:
+                f.write(content)
+            os.utime(path, (mtime, mtime))
+
+        manifest['files'] += len(paths)
+        manifest['bytes'] += len(content) * len(paths)
+        manifest[f'type{file_type}'] += len(paths)
+        manifest['duplicate_groups'] += len(paths) > 1
+        manifest['copies'] += len(paths) - 1
+
+    return manifest
+
+
+def _make_name(rng, file_type, i) -> str:
+    if file_type in {'.exe', '.msi'} and rng.random() < 0.7:
+        return f'{rng.choice(WORDS)}_{rng.choice(INSTALLER_NAMES)}_{rng.randint(1, 9)}_{rng.randint(0, 99)}'
+
+    words = rng.sample(WORDS, rng.randint(1, 3))
+    separator = rng.choice(['_', '-', ' '])
+    if rng.random() < 0.5:
+        words[0] = words[0].capitalize()
+
+    # The index keeps names unique across the corpus
+    return separator.join(words) + f'{separator}{rng.randint(2015, 2025)}{separator}{i}'
+
+
+def _make_content(rng, file_type, name) -> bytes:
+    text = ' '.join(rng.choices(WORDS, k=rng.randint(20, 400)))
+
+    if file_type == '.pdf':
+        return _make_pdf(f'{name} {text}')
+    elif file_type == '.docx':
+        return _make_docx([name, *_split_lines(text)])
+    elif file_type == '.xlsx':
+        return _make_xlsx([['Item', 'Amount', 'Note'], *[[word, rng.randint(1, 10_000), rng.choice(WORDS)]
+                                                           for word in rng.choices(WORDS, k=rng.randint(5, 200))]])
+    elif file_type == '.csv':
+        rows = [f'{word},{rng.randint(1, 10_000)},{rng.choice(WORDS)}' for word in rng.choices(WORDS, k=rng.randint(5, 500))]
+        return '\n'.join(['item,amount,note', *rows]).encode()
+    elif file_type == '.json':
+        items = [f'{{"name": "{word}", "value": {rng.randint(1, 10_000)}}}' for word in rng.choices(WORDS, k=rng.randint(5, 300))]
+        return ('{"title": "%s", "items": [%s]}' % (name, ', '.join(items))).encode()
+    elif file_type in {'.txt', '.md'}:
+        return '\n'.join([f'# {name}', *_split_lines(text)]).encode()
+    elif file_type in CODE_TEMPLATES:
+        return ''.join(CODE_TEMPLATES[file_type].format(*rng.sample(WORDS, 2), rng.randint(1, 100))
+                       for _ in range(rng.randint(3, 60))).encode()
+
+    # Binaries are rounded to whole KB, so many of them share a size without being duplicates
+    size_kb = rng.randint(1024, 4096) if rng.random() < LARGE_BINARY_RATIO else int(rng.lognormvariate(3, 1)) + 1
+    return rng.randbytes(size_kb * 1024)
+
+
+def _split_lines(text: str, words_per_line: int = 12) -> list[str]:
+    words = text.split()
+    return [' '.join(words[i:i + words_per_line]) for i in range(0, len(words), words_per_line)]
+
+
+def _make_pdf(text: str) -> bytes:
+    lines = ' '.join(f'({_escape_pdf(line)}) Tj T*' for line in _split_lines(text)[:40])
+    stream = f'BT /F1 11 Tf 14 TL 72 740 Td {lines} ET'
+
+    objects = [
+        '<< /Type /Catalog /Pages 2 0 R >>',
+        '<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        '<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R '
+        '/Resources << /Font << /F1 5 0 R >> >> >>',
+        f'<< /Length {len(stream)} >>\nstream\n{stream}\nendstream',
+        '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+    ]
+
+    pdf = io.BytesIO()
+    pdf.write(b'%PDF-1.4\n')
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(pdf.tell())
+        pdf.write(f'{number} 0 obj\n{obj}\nendobj\n'.encode('latin-1'))
+
+    xref_offset = pdf.tell()
+    pdf.write(f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode())
+    pdf.write(''.join(f'{offset:010d} 00000 n \n' for offset in offsets).encode())
+    pdf.write(f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n'.encode())
+
+    return pdf.getvalue()
+
+
+def _escape_pdf(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+# The smallest OOXML packages that python-docx and openpyxl open, written directly since building them through
+# those libraries would dominate the generation time
+def _make_docx(paragraphs: list[str]) -> bytes:
+    body = ''.join(f'<w:p><w:r><w:t>{escape(paragraph)}</w:t></w:r></w:p>' for paragraph in paragraphs)
+
+    return _make_zip({
+        '[Content_Types].xml': '<?xml version="1.0" encoding="UTF-8"?>'
+                               '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                               '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                               '<Default Extension="xml" ContentType="application/xml"/>'
+                               '<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+                               '</Types>',
+        '_rels/.rels': '<?xml version="1.0" encoding="UTF-8"?>'
+                       '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                       '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>'
+                       '</Relationships>',
+        'word/document.xml': '<?xml version="1.0" encoding="UTF-8"?>'
+                             '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+                             f'<w:body>{body}</w:body></w:document>',
+    })
+
+
+def _make_xlsx(rows: list[list]) -> bytes:
+    sheet_rows = ''.join(
+        f'<row r="{r}">' + ''.join(
+            f'<c r="{_column_name(c)}{r}"><v>{value}</v></c>' if isinstance(value, int)
+            else f'<c r="{_column_name(c)}{r}" t="inlineStr"><is><t>{escape(str(value))}</t></is></c>'
+            for c, value in enumerate(row)) + '</row>'
+        for r, row in enumerate(rows, start=1))
+
+    return _make_zip({
+        '[Content_Types].xml': '<?xml version="1.0" encoding="UTF-8"?>'
+                               '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                               '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                               '<Default Extension="xml" ContentType="application/xml"/>'
+                               '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+                               '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+                               '</Types>',
+        '_rels/.rels': '<?xml version="1.0" encoding="UTF-8"?>'
+                       '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                       '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+                       '</Relationships>',
+        'xl/workbook.xml': '<?xml version="1.0" encoding="UTF-8"?>'
+                           '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+                           'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+                           '<sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets></workbook>',
+        'xl/_rels/workbook.xml.rels': '<?xml version="1.0" encoding="UTF-8"?>'
+                                      '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                                      '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+                                      '</Relationships>',
+        'xl/worksheets/sheet1.xml': '<?xml version="1.0" encoding="UTF-8"?>'
+                                    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                                    f'<sheetData>{sheet_rows}</sheetData></worksheet>',
+    })
+
+
+def _column_name(index: int) -> str:
+    return chr(ord('A') + index)
+
+
+def _make_zip(parts: dict) -> bytes:
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, content in parts.items():
+            # A fixed timestamp keeps identical documents byte-identical
+            archive.writestr(zipfile.ZipInfo(name, date_time=(2020, 1, 1, 0, 0, 0)), content,
+                             compress_type=zipfile.ZIP_DEFLATED)
+    return output.getvalue()
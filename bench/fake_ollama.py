@@ -0,0 +1,323 @@
+import argparse
+import collections
+import datetime
+import http.server
+import json
+import re
+import threading
+import time
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 11435
+REQUEST_LATENCY = 0.2
+TOKEN_LATENCY = 0.02
+MODEL_LOAD_LATENCY = 2.0
+MAX_CONCURRENCY = 4
+MAX_QUEUE = 512
+THINK_TOKENS = 64
+NUM_KEYWORDS = 5
+
+TOKEN_PATTERN = re.compile(r'\s*\S{1,4}')
+COMPACT_FILE_PATTERN = re.compile(r'^(\d+) (.+)$', re.MULTILINE)
+DELETE_HINT_PATTERN = re.compile(r'\(\d+\)|setup|install', re.IGNORECASE)
+WORD_PATTERN = re.compile(r'[a-z]{3,}')
+
+CATEGORIES_BY_TYPE = {
+    '.pdf': 'Documents', '.docx': 'Documents', '.doc': 'Documents', '.txt': 'Documents', '.md': 'Documents',
+    '.xlsx': 'Spreadsheets', '.csv': 'Spreadsheets', '.json': 'Data', '.xml': 'Data', '.yaml': 'Data',
+    '.py': 'Code', '.js': 'Code', '.ts': 'Code', '.java': 'Code', '.c': 'Code', '.cpp': 'Code', '.sql': 'Code',
+    '.html': 'Code', '.css': 'Code', '.exe': 'Installers', '.msi': 'Installers', '.dmg': 'Installers',
+    '.zip': 'Archives', '.7z': 'Archives', '.png': 'Images', '.jpg': 'Images', '.mp4': 'Videos',
+}
+FILLER_KEYWORDS = ['document', 'notes', 'report', 'data', 'file']
+
+
+# Speaks enough of the Ollama HTTP API (/api/chat, /api/generate, /api/tags, /api/version) for ollama.Client and
+# ollama.AsyncClient, and answers with scripted DeepSeek-style (<think> + JSON) and PHI-style responses. Like a
+# single GPU it keeps one model loaded, runs up to max_concurrency requests for it at once, queues the rest and
+# charges model_load_latency whenever it has to swap models, so throughput can be measured without real models.
+class FakeOllamaServer:
+    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, request_latency: float = REQUEST_LATENCY,
+                 token_latency: float = TOKEN_LATENCY, model_load_latency: float = MODEL_LOAD_LATENCY,
+                 max_concurrency: int = MAX_CONCURRENCY, max_queue: int = MAX_QUEUE,
+                 think_tokens: int = THINK_TOKENS):
+        self.request_latency = request_latency
+        self.token_latency = token_latency
+        self.model_load_latency = model_load_latency
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.think_tokens = think_tokens
+
+        self.loaded_model = None
+        self.stats = collections.Counter(dict.fromkeys(['requests', 'prompt_tokens', 'tokens', 'model_loads',
+                                                        'max_active', 'rejected', 'disconnects'], 0))
+
+        self._condition = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+
+        self._server = http.server.ThreadingHTTPServer((host, port), _make_handler(self))
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *_):
+        self.stop()
+
+    def get_stats(self) -> dict:
+        with self._condition:
+            return {**self.stats, 'active': self._active, 'waiting': self._waiting}
+
+    def acquire(self, model: str) -> bool:
+        with self._condition:
+            if self._waiting >= self.max_queue:
+                self.stats['rejected'] += 1
+                return False
+
+            self._waiting += 1
+            self._condition.wait_for(lambda: self._active < self.max_concurrency
+                                     and (model == self.loaded_model or self._active == 0))
+            self._waiting -= 1
+            self._active += 1
+            self.stats['max_active'] = max(self.stats['max_active'], self._active)
+
+            needs_load = model != self.loaded_model
+            if needs_load:
+                self.loaded_model = model
+                self.stats['model_loads'] += 1
+
+        # Nothing else runs while a model is loading, since the previous model had no active requests left
+        if needs_load:
+            time.sleep(self.model_load_latency)
+        return True
+
+    def release(self):
+        with self._condition:
+            self._active -= 1
+            self._condition.notify_all()
+
+    def respond(self, model: str, prompt: str):
+        with self._condition:
+            self.stats['requests'] += 1
+            self.stats['prompt_tokens'] += len(TOKEN_PATTERN.findall(prompt))
+
+        tokens = TOKEN_PATTERN.findall(script_response(model, prompt, self.think_tokens))
+        time.sleep(self.request_latency)
+
+        for token in tokens:
+            time.sleep(self.token_latency)
+            with self._condition:
+                self.stats['tokens'] += 1
+            yield token
+
+
+def script_response(model: str, prompt: str, think_tokens: int = THINK_TOKENS) -> str:
+    if not prompt:
+        return ''
+
+    if not model.startswith('deepseek'):
+        return _script_keywords(prompt)
+
+    thinking = ' '.join(['Considering the files.'] * max(1, think_tokens // 4))
+
+    if '"assignments"' in prompt:
+        response = {'assignments': _script_assignments(prompt)}
+    elif '"deletions"' in prompt:
+        response = {'deletions': _script_deletions(prompt)}
+    elif '"results"' in prompt:
+        response = {'results': _script_results(prompt)}
+    else:
+        response = {}
+
+    return f'<think>\n{thinking}\n</think>\n\n```json\n{json.dumps(response, indent=2)}\n```'
+
+
+def _script_keywords(prompt: str) -> str:
+    batch_files = re.findall(r'^\s*### (.+)$', prompt, re.MULTILINE)
+    if batch_files:
+        return json.dumps({filename: _make_keywords(filename) for filename in batch_files})
+
+    match = re.search(r'contents of this file \((.*?)\)', prompt)
+    return _make_keywords(match.group(1)) if match else 'Unknown'
+
+
+def _make_keywords(filename: str) -> str:
+    words = list(dict.fromkeys(WORD_PATTERN.findall(filename.lower())))
+    return ', '.join((words + FILLER_KEYWORDS)[:NUM_KEYWORDS])
+
+
+# Compact prompts list files as `id name...` under [.ext] headers, verbose prompts as `filename.ext: ...`
+def _get_files(prompt: str) -> list[tuple[str, str, str]]:
+    files_section = prompt.split('Files:', 1)[-1].split('Filenames to categorize:', 1)[-1]
+
+    if re.search(r'^\[', files_section, re.MULTILINE):
+        files = []
+        extension = ''
+        for line in files_section.splitlines():
+            line = line.strip()
+            if line.startswith('['):
+                extension = line.strip('[]')
+                continue
+
+            match = COMPACT_FILE_PATTERN.match(line)
+            if match:
+                files.append((match.group(1), match.group(2), extension))
+        return files
+
+    files = []
+    for line in files_section.splitlines():
+        filename = line.strip().split(':', 1)[0]
+        if '.' in filename and ' ' not in filename.strip():
+            files.append((filename, filename, '.' + filename.rsplit('.', 1)[-1].lower()))
+    return files
+
+
+def _script_assignments(prompt: str) -> dict:
+    return {file_id: CATEGORIES_BY_TYPE.get(extension, 'Other') for file_id, _, extension in _get_files(prompt)}
+
+
+def _script_deletions(prompt: str) -> dict:
+    return {file_id: 'Duplicate or installer' for file_id, text, _ in _get_files(prompt)
+            if DELETE_HINT_PATTERN.search(text)}
+
+
+def _script_results(prompt: str) -> list:
+    match = re.search(r'match the query "(.*?)"', prompt)
+    query_words = set(WORD_PATTERN.findall(match.group(1).lower())) if match else set()
+
+    return [file_id for file_id, text, _ in _get_files(prompt)
+            if query_words.intersection(WORD_PATTERN.findall(text.lower()))][:10]
+
+
+def _make_handler(server: FakeOllamaServer):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            if self.path == '/api/version':
+                self._send_json({'version': '0.0.0-fake'})
+            elif self.path == '/api/tags':
+                self._send_json({'models': [{'name': server.loaded_model}] if server.loaded_model else []})
+            else:
+                self._send_json({'error': 'not found'}, 404)
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+
+            if self.path == '/api/chat':
+                prompt = '\n'.join(message.get('content', '') for message in body.get('messages', []))
+                self._respond(body, prompt, lambda text: {'message': {'role': 'assistant', 'content': text}})
+            elif self.path == '/api/generate':
+                self._respond(body, body.get('prompt', ''), lambda text: {'response': text})
+            else:
+                self._send_json({'error': 'not found'}, 404)
+
+        def _respond(self, body, prompt, make_message):
+            model = body.get('model', '')
+            if not server.acquire(model):
+                self._send_json({'error': 'server busy, please try again'}, 503)
+                return
+
+            try:
+                start_time = time.monotonic_ns()
+                tokens = server.respond(model, prompt)
+
+                if not body.get('stream', True):
+                    text = ''.join(tokens)
+                    self._send_json({**self._make_chunk(model, make_message(text), True),
+                                     **self._make_totals(start_time, prompt, text)})
+                    return
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+
+                text = ''
+                for token in tokens:
+                    text += token
+                    self._write_chunk(self._make_chunk(model, make_message(token), False))
+
+                self._write_chunk({**self._make_chunk(model, make_message(''), True),
+                                   **self._make_totals(start_time, prompt, text)})
+                self.wfile.write(b'0\r\n\r\n')
+            except (BrokenPipeError, ConnectionResetError):
+                # The client gave up (e.g. a cancelled or timed out request), which stops the generation
+                with server._condition:
+                    server.stats['disconnects'] += 1
+            finally:
+                server.release()
+
+        def _write_chunk(self, data: dict):
+            line = json.dumps(data).encode() + b'\n'
+            self.wfile.write(f'{len(line):x}\r\n'.encode() + line + b'\r\n')
+            self.wfile.flush()
+
+        def _send_json(self, data: dict, status: int = 200):
+            payload = json.dumps(data).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        @staticmethod
+        def _make_chunk(model, message, done) -> dict:
+            return {'model': model, 'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                    **message, 'done': done, **({'done_reason': 'stop'} if done else {})}
+
+        @staticmethod
+        def _make_totals(start_time, prompt, text) -> dict:
+            return {'total_duration': time.monotonic_ns() - start_time,
+                    'prompt_eval_count': len(TOKEN_PATTERN.findall(prompt)),
+                    'eval_count': len(TOKEN_PATTERN.findall(text))}
+
+        def log_message(self, *_):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a fake Ollama server with scripted responses.')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--request-latency', type=float, default=REQUEST_LATENCY)
+    parser.add_argument('--token-latency', type=float, default=TOKEN_LATENCY)
+    parser.add_argument('--model-load-latency', type=float, default=MODEL_LOAD_LATENCY)
+    parser.add_argument('--max-concurrency', type=int, default=MAX_CONCURRENCY)
+    parser.add_argument('--max-queue', type=int, default=MAX_QUEUE)
+    parser.add_argument('--think-tokens', type=int, default=THINK_TOKENS)
+    args = parser.parse_args()
+
+    server = FakeOllamaServer(args.host, args.port, args.request_latency, args.token_latency,
+                              args.model_load_latency, args.max_concurrency, args.max_queue, args.think_tokens)
+
+    print(f'Fake Ollama server listening on {server.url}, run the app with OLLAMA_HOST={server.url}')
+    with server:
+        try:
+            while True:
+                time.sleep(60)
+                print(server.get_stats())
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
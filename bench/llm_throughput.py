@@ -0,0 +1,99 @@
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from bench import fake_ollama
+from core import categorize, keywords, llm_interaction, metadata, search, suggest_deletions
+
+NUM_FILES = 200
+RESULTS_PATH = 'llm_throughput.json'
+SEARCH_QUERY = 'invoice report'
+
+WORDS = ['invoice', 'report', 'budget', 'notes', 'resume', 'project', 'lecture', 'homework', 'receipt', 'photo',
+         'draft', 'meeting', 'taxes', 'contract', 'summary', 'dataset', 'backup', 'setup', 'travel', 'syllabus']
+TYPES = ['.txt', '.md', '.csv', '.json', '.py', '.exe', '.zip']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure LLM stage throughput against the fake Ollama server.')
+    parser.add_argument('--files', type=int, default=NUM_FILES)
+    parser.add_argument('--request-latency', type=float, default=fake_ollama.REQUEST_LATENCY)
+    parser.add_argument('--token-latency', type=float, default=fake_ollama.TOKEN_LATENCY)
+    parser.add_argument('--model-load-latency', type=float, default=fake_ollama.MODEL_LOAD_LATENCY)
+    parser.add_argument('--max-concurrency', type=int, default=fake_ollama.MAX_CONCURRENCY)
+    parser.add_argument('--batch', action='store_true', help='Batch several files per keywords prompt')
+    parser.add_argument('--output', default=RESULTS_PATH)
+    args = parser.parse_args()
+
+    server = fake_ollama.FakeOllamaServer(port=0, request_latency=args.request_latency,
+                                          token_latency=args.token_latency,
+                                          model_load_latency=args.model_load_latency,
+                                          max_concurrency=args.max_concurrency)
+
+    # Every request has to reach the server, so neither the response cache nor the keywords cache is used
+    llm_interaction.OLLAMA_HOST = server.url
+    llm_interaction.USE_RESPONSE_CACHE = False
+    llm_interaction.scheduler.max_parallel = args.max_concurrency
+
+    with server, tempfile.TemporaryDirectory() as folder_path:
+        _write_files(folder_path, args.files)
+        df = metadata.get_files_metadata(folder_path)
+
+        results = {'files': len(df), 'server': {'request_latency': args.request_latency,
+                                                'token_latency': args.token_latency,
+                                                'model_load_latency': args.model_load_latency,
+                                                'max_concurrency': args.max_concurrency}}
+
+        df, results['keywords'] = _measure(server, len(df), lambda: keywords.get_keywords(df, use_cache=False,
+                                                                                        batch=args.batch))
+        df, results['categorize'] = _measure(server, len(df), lambda: categorize.categorize(df))
+        _, results['search'] = _measure(server, len(df), lambda: search.search(df, SEARCH_QUERY, 10))
+        _, results['suggest_deletions'] = _measure(server, len(df),
+                                                   lambda: suggest_deletions.suggest_deletions(df, 365, 100_000,
+                                                                                               use_rules=False))
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    for stage, stage_results in results.items():
+        if isinstance(stage_results, dict) and 'seconds' in stage_results:
+            print(f"{stage}: {stage_results['seconds']:.2f}s, {stage_results['files_per_second']:.1f} files/s, "
+                  f"{stage_results['requests']} requests, {stage_results['model_loads']} model loads")
+
+
+def _measure(server, num_files, run):
+    stats_before = server.get_stats()
+    switches_before = llm_interaction.scheduler.model_switches
+
+    start_time = time.perf_counter()
+    result = run()
+    elapsed = time.perf_counter() - start_time
+
+    stats = server.get_stats()
+    return result, {
+        'seconds': elapsed,
+        'files_per_second': num_files / elapsed,
+        'requests': stats['requests'] - stats_before['requests'],
+        'tokens': stats['tokens'] - stats_before['tokens'],
+        'tokens_per_second': (stats['tokens'] - stats_before['tokens']) / elapsed,
+        'model_loads': stats['model_loads'] - stats_before['model_loads'],
+        'model_switches': llm_interaction.scheduler.model_switches - switches_before,
+        'max_active_requests': stats['max_active'],
+    }
+
+
+def _write_files(folder_path, num_files):
+    rng = random.Random(0)
+
+    for i in range(num_files):
+        name = '_'.join(rng.sample(WORDS, 2))
+        file_type = rng.choice(TYPES)
+        with open(os.path.join(folder_path, f'{name}_{i}{file_type}'), 'w') as f:
+            f.write(' '.join(rng.choices(WORDS, k=50)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+import core.cache
+from bench import corpus
+from core import keywords, metadata, prompts, suggest_deletions
+from ui import file_interaction
+
+CORPUS_SIZES = [1_000, 10_000]
+EXTRACT_SAMPLE_SIZE = 2_000
+SEARCH_SHORTLIST_SIZE = 50
+AGE_THRESHOLD_DAYS = 365
+SIZE_THRESHOLD_KB = 1024
+RESULTS_PATH = 'benchmark_results.json'
+REGRESSION_THRESHOLD = 1.2
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the non-LLM stages on synthetic Downloads folders.')
+    parser.add_argument('--files', type=int, nargs='+', default=CORPUS_SIZES,
+                        help='Corpus sizes to run, from 1k up to 1M files')
+    parser.add_argument('--extract-sample', type=int, default=EXTRACT_SAMPLE_SIZE,
+                        help='Number of text-based files to extract content from')
+    parser.add_argument('--no-trace-memory', action='store_true',
+                        help='Skip tracemalloc, which slows down allocation-heavy stages')
+    parser.add_argument('--workdir', help='Where to generate corpora (defaults to a temporary folder)')
+    parser.add_argument('--output', default=RESULTS_PATH)
+    parser.add_argument('--compare', help='Earlier results file to compare against')
+    args = parser.parse_args()
+
+    # Timings taken with and without tracemalloc are not comparable, so the setting is part of the results
+    results = {'environment': {**_get_environment(), 'trace_memory': not args.no_trace_memory}, 'runs': []}
+
+    for num_files in args.files:
+        with tempfile.TemporaryDirectory(dir=args.workdir) as workdir:
+            print(f'Generating {num_files:,} files...')
+            folder_path = os.path.join(workdir, 'Downloads')
+            manifest = corpus.generate_corpus(folder_path, num_files)
+
+            # Move journals and other cache files go with the corpus instead of into the user's cache folder.
+            # core.cache reads LLM_FILE_MANAGER_CACHE_DIR on import, so its CACHE_DIR is pointed there too.
+            cache_dir = os.path.join(workdir, 'cache')
+            with _cache_dir(cache_dir):
+                stages = _run_stages(folder_path, args.extract_sample, not args.no_trace_memory)
+            results['runs'].append({'files': num_files, 'corpus': manifest, 'stages': stages})
+
+            for stage, stage_results in stages.items():
+                print(f"  {stage}: {stage_results['seconds']:.3f}s "
+                      f"({stage_results['items_per_second']:,.0f} items/s, "
+                      f"peak {(stage_results['peak_memory_bytes'] or 0) / 1024 ** 2:,.1f} MB)")
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'Results written to {args.output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            _print_comparison(json.load(f), results)
+
+
+def _run_stages(folder_path, extract_sample, trace_memory) -> dict:
+    stages = {}
+
+    df, stages['get_files_metadata'] = _measure(lambda: metadata.get_files_metadata(folder_path), len, trace_memory)
+
+    text_paths = df.loc[df['Type'].isin(keywords.TEXT_BASED_FILETYPES), 'Path']
+    sample_paths = text_paths.sample(min(extract_sample, len(text_paths)), random_state=0).tolist()
+    _, stages['extract_file_content'] = _measure(lambda: [_extract(path) for path in sample_paths], len,
+                                                 trace_memory)
+
+    # Keywords and categories stand in for what the LLM stages would have added
+    df['Keywords'] = df['Filename'].str.lower().str.findall(r'[a-z]{3,}').str.join(', ')
+    df['LLM-Categorized'] = df['Type'].map(lambda file_type: file_type.lstrip('.').upper() or 'Other')
+
+    stages['encode_categorize_prompt'] = _measure(lambda: prompts.encode_categorize_prompt(df), lambda _: len(df),
+                                                  trace_memory)[1]
+    stages['encode_delete_prompt'] = _measure(
+        lambda: prompts.encode_delete_prompt(df, [], AGE_THRESHOLD_DAYS, SIZE_THRESHOLD_KB), lambda _: len(df),
+        trace_memory)[1]
+    shortlist_df = df.head(SEARCH_SHORTLIST_SIZE)
+    stages['encode_search_prompt'] = _measure(lambda: prompts.encode_search_prompt(shortlist_df, 'invoice 2023', 10),
+                                              lambda _: len(shortlist_df), trace_memory)[1]
+
+    duplicates, stages['find_duplicates'] = _measure(lambda: suggest_deletions.find_duplicates(df, use_cache=False),
+                                                     lambda _: len(df), trace_memory)
+    stages['find_duplicates']['duplicate_groups'] = len(duplicates)
+
+    _, stages['move_to_category_folders'] = _measure(
+        lambda: file_interaction.move_to_category_folders(df, destination_folder=folder_path), lambda _: len(df),
+        trace_memory)
+
+    return stages
+
+
+@contextlib.contextmanager
+def _cache_dir(cache_dir):
+    previous_env = os.environ.get('LLM_FILE_MANAGER_CACHE_DIR')
+    previous_cache_dir = core.cache.CACHE_DIR
+    os.environ['LLM_FILE_MANAGER_CACHE_DIR'] = core.cache.CACHE_DIR = cache_dir
+
+    try:
+        yield
+    finally:
+        core.cache.CACHE_DIR = previous_cache_dir
+        if previous_env is None:
+            os.environ.pop('LLM_FILE_MANAGER_CACHE_DIR', None)
+        else:
+            os.environ['LLM_FILE_MANAGER_CACHE_DIR'] = previous_env
+
+
+def _extract(path):
+    try:
+        return keywords._extract_file_content(path)
+    except Exception:
+        return None
+
+
+def _measure(run, count_items, trace_memory):
+    if trace_memory:
+        tracemalloc.start()
+
+    start_time = time.perf_counter()
+    result = run()
+    elapsed = time.perf_counter() - start_time
+
+    peak_memory = None
+    if trace_memory:
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    items = count_items(result)
+    return result, {
+        'seconds': elapsed,
+        'items': items,
+        'items_per_second': items / max(elapsed, 1e-9),
+        'peak_memory_bytes': peak_memory,
+        'max_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }
+
+
+def _get_environment() -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def _print_comparison(previous, current):
+    previous_runs = {run['files']: run['stages'] for run in previous['runs']}
+
+    print(f"Compared with {previous['environment'].get('commit') or 'previous run'}:")
+    for run in current['runs']:
+        for stage, stage_results in run['stages'].items():
+            previous_results = previous_runs.get(run['files'], {}).get(stage)
+            if not previous_results:
+                continue
+
+            ratio = stage_results['seconds'] / max(previous_results['seconds'], 1e-9)
+            flag = '  <-- slower' if ratio > REGRESSION_THRESHOLD else ''
+            print(f"  {run['files']:>9,} files {stage}: {ratio:.2f}x{flag}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import sys
+import time
+
+import pandas as pd
+
+from core import categorize, keywords, llm_interaction, metadata, suggest_deletions
+from ui import file_interaction
+
+STAGES = ['scan', 'keywords', 'categorize', 'deletions', 'organize']
+FOLDER_CONCURRENCY = 2
+MAX_AGE_DAYS = 30
+MAX_SIZE_KB = 1024
+RESULTS_PATH = 'batch_results.jsonl'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Scan, categorize, suggest deletions for and organize folders '
+                                                 'without the UI.')
+    parser.add_argument('folders', nargs='+')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES,
+                        help='Stages to run; scan always runs')
+    parser.add_argument('--dry-run', action='store_true', help='Only plan the moves of the organize stage')
+    parser.add_argument('--categories', nargs='+', help='Categories to prefer when categorizing')
+    parser.add_argument('--max-age-days', type=int, default=MAX_AGE_DAYS)
+    parser.add_argument('--max-size-kb', type=int, default=MAX_SIZE_KB)
+    parser.add_argument('--concurrency', type=int, default=FOLDER_CONCURRENCY,
+                        help='Number of folders processed at once')
+    parser.add_argument('--timeout', type=float, help='Timeout in seconds for each LLM request')
+    parser.add_argument('--output', default=RESULTS_PATH, help='A .jsonl or .parquet file with one row per file')
+    parser.add_argument('--format', choices=['jsonl', 'parquet'], help='Defaults to the extension of --output')
+    parser.add_argument('--summary', help='Also write the per-stage throughput summary to this JSON file')
+    args = parser.parse_args()
+
+    output_format = args.format or ('parquet' if args.output.endswith('.parquet') else 'jsonl')
+    if output_format == 'parquet' and not (importlib.util.find_spec('pyarrow')
+                                           or importlib.util.find_spec('fastparquet')):
+        parser.error('Parquet output needs pyarrow or fastparquet')
+    if 'organize' in args.stages and 'categorize' not in args.stages:
+        parser.error('The organize stage needs the categorize stage')
+
+    missing_folders = [folder for folder in args.folders if not os.path.isdir(folder)]
+    if missing_folders:
+        parser.error(f'Not a folder: {", ".join(missing_folders)}')
+
+    batch = BatchRun(args.stages, args.dry_run, args.categories, args.max_age_days, args.max_size_kb, args.timeout)
+    folder_dfs, errors = llm_interaction.run_sync(batch.run([os.path.abspath(folder) for folder in args.folders],
+                                                            args.concurrency))
+
+    _write_results(folder_dfs, args.output, output_format)
+    print(f'Results written to {args.output}')
+
+    summary = batch.get_summary()
+    _print_summary(summary)
+    if args.summary:
+        with open(args.summary, 'w') as f:
+            json.dump({'stages': summary, 'errors': errors, 'dry_run': args.dry_run}, f, indent=2)
+
+    for folder, error in errors.items():
+        print(f'Failed to process {folder}: {error}', file=sys.stderr)
+    if errors:
+        sys.exit(1)
+
+
+# Folders run concurrently on one event loop, so their LLM requests all go through the model scheduler and a slow
+# folder doesn't hold up the others. Scanning and moving files block, so they run on threads.
+class BatchRun:
+    def __init__(self, stages, dry_run=False, user_categories=None, max_age_days=MAX_AGE_DAYS,
+                 max_size_kb=MAX_SIZE_KB, timeout=None):
+        self.stages = stages
+        self.dry_run = dry_run
+        self.user_categories = user_categories
+        self.max_age_days = max_age_days
+        self.max_size_kb = max_size_kb
+        self.timeout = timeout
+
+        self._timings = {stage: [] for stage in STAGES}
+
+    async def run(self, folders: list[str], concurrency: int = FOLDER_CONCURRENCY):
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def run_folder(folder):
+            async with semaphore:
+                try:
+                    return folder, await self.run_folder(folder), None
+                except Exception as e:
+                    return folder, None, f'{type(e).__name__}: {e}'
+
+        folder_dfs = {}
+        errors = {}
+        for folder, df, error in await asyncio.gather(*[run_folder(folder) for folder in folders]):
+            if error:
+                errors[folder] = error
+            else:
+                folder_dfs[folder] = df
+
+        return folder_dfs, errors
+
+    async def run_folder(self, folder: str) -> pd.DataFrame:
+        df = await self._measure('scan', lambda: asyncio.to_thread(lambda: metadata.get_files_delta(folder).df))
+        print(f'{folder}: {len(df):,} files')
+        if df.empty:
+            return df
+
+        if 'keywords' in self.stages:
+            df = await self._measure('keywords', lambda: keywords.get_keywords_async(df, timeout=self.timeout),
+                                     len(df))
+
+        # Categories carried over from the last run are kept, so a scheduled run only categorizes new files
+        if 'categorize' in self.stages:
+            df = await self._measure('categorize', lambda: categorize.categorize_async(
+                df, use_keywords='keywords' in self.stages, user_categories=self.user_categories,
+                only_uncategorized=True, timeout=self.timeout), len(df))
+
+        if 'deletions' in self.stages:
+            df = await self._measure('deletions', lambda: suggest_deletions.suggest_deletions_async(
+                df, self.max_age_days, self.max_size_kb, timeout=self.timeout), len(df))
+
+        await asyncio.to_thread(metadata.save_snapshot, df, folder)
+
+        if 'organize' in self.stages:
+            result = await self._measure('organize', lambda: asyncio.to_thread(
+                file_interaction.move_to_category_folders, df, folder, self.dry_run), len(df))
+            df['Organized-To'] = df['Path'].map(dict(result.moved))
+            df['Organize-Skipped'] = df['Path'].map(result.plan.skipped)
+            df['Organize-Error'] = df['Path'].map(result.failed)
+            if result.journal_path:
+                print(f'{folder}: {len(result.moved):,} files moved, journal at {result.journal_path}')
+
+        return df
+
+    # Busy time adds up the time spent on each folder; throughput is over the stage's wall time, the time during
+    # which at least one folder was in the stage, which is what running folders concurrently improves
+    def get_summary(self) -> dict:
+        summary = {}
+        for stage, timings in self._timings.items():
+            if not timings:
+                continue
+
+            files = sum(items for _, _, items in timings)
+            wall_seconds = 0
+            covered_until = 0
+            for start, end, _ in sorted(timings):
+                wall_seconds += max(0, end - max(start, covered_until))
+                covered_until = max(covered_until, end)
+            summary[stage] = {
+                'folders': len(timings),
+                'files': files,
+                'busy_seconds': sum(end - start for start, end, _ in timings),
+                'wall_seconds': wall_seconds,
+                'files_per_second': files / max(wall_seconds, 1e-9),
+            }
+
+        return summary
+
+    async def _measure(self, stage, run, items=None):
+        start_time = time.perf_counter()
+        result = await run()
+        self._timings[stage].append((start_time, time.perf_counter(), len(result) if items is None else items))
+        return result
+
+
+def _write_results(folder_dfs, output_path, output_format):
+    if folder_dfs:
+        df = pd.concat(folder_dfs, names=['Folder', None]).reset_index(level='Folder').reset_index(drop=True)
+    else:
+        df = pd.DataFrame(columns=['Folder'])
+
+    if output_format == 'parquet':
+        # Columns like Keywords mix strings and NaN, which Parquet stores as nullable strings
+        df.astype({column: 'string' for column in df.columns if df[column].dtype == object}).to_parquet(output_path,
+                                                                                                     index=False)
+    else:
+        df.to_json(output_path, orient='records', lines=True, date_format='iso')
+
+
+def _print_summary(summary):
+    print(f"{'Stage':<12}{'Folders':>9}{'Files':>12}{'Busy (s)':>12}{'Wall (s)':>12}{'Files/s':>12}")
+    for stage, stage_summary in summary.items():
+        print(f"{stage:<12}{stage_summary['folders']:>9,}{stage_summary['files']:>12,}"
+              f"{stage_summary['busy_seconds']:>12.2f}{stage_summary['wall_seconds']:>12.2f}"
+              f"{stage_summary['files_per_second']:>12,.1f}")
+
+
+if __name__ == '__main__':
+    main()
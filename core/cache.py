@@ -0,0 +1,192 @@
+import hashlib
+import json
+import mmap
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_DIR = os.environ.get('LLM_FILE_MANAGER_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.llm_file_manager'))
+
+HASH_CHUNK_SIZE = 1024 * 1024
+EDGE_HASH_SIZE = 4 * 1024
+
+
+def get_cache_path(filename: str) -> str:
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    return os.path.join(CACHE_DIR, filename)
+
+
+def hash_file(path: str) -> str:
+    hasher = hashlib.sha256()
+
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return hasher.hexdigest()
+
+        # Hashing memoryview slices of the mapping avoids copying the file through Python buffers
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            with memoryview(mapped) as view:
+                for offset in range(0, size, HASH_CHUNK_SIZE):
+                    hasher.update(view[offset:offset + HASH_CHUNK_SIZE])
+
+    return hasher.hexdigest()
+
+
+def hash_file_edges(path: str) -> str:
+    hasher = hashlib.sha256()
+
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        hasher.update(f.read(EDGE_HASH_SIZE))
+
+        if size > EDGE_HASH_SIZE:
+            f.seek(max(EDGE_HASH_SIZE, size - EDGE_HASH_SIZE))
+            hasher.update(f.read(EDGE_HASH_SIZE))
+
+    return hasher.hexdigest()
+
+
+class FileCache:
+    def __init__(self, name: str, db_path: str | None = None):
+        self.db_path = db_path or get_cache_path(f'{name}.sqlite3')
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS entries ('
+                           'path TEXT PRIMARY KEY, size INTEGER, mtime REAL, content_hash TEXT, value TEXT)')
+        self._conn.commit()
+
+    def get(self, path: str, size: int, mtime: float, hash_fn=None):
+        with self._lock:
+            row = self._conn.execute('SELECT size, mtime, content_hash, value FROM entries WHERE path = ?',
+                                     (path,)).fetchone()
+
+        if row is not None:
+            cached_size, cached_mtime, cached_hash, value = row
+
+            if cached_size == size and cached_mtime == mtime:
+                return self._hit(value)
+
+            # The file was touched but possibly not changed, so compare contents before giving up on the entry
+            if hash_fn and cached_hash and cached_size == size and hash_fn(path) == cached_hash:
+                with self._lock:
+                    self._conn.execute('UPDATE entries SET mtime = ? WHERE path = ?', (mtime, path))
+                    self._conn.commit()
+                return self._hit(value)
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, path: str, size: int, mtime: float, value: str, content_hash: str | None = None):
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO entries (path, size, mtime, content_hash, value) '
+                               'VALUES (?, ?, ?, ?, ?)', (path, size, mtime, content_hash, value))
+            self._conn.commit()
+
+    def evict_missing(self, folders=None) -> int:
+        folders = {os.path.normpath(folder) for folder in folders} if folders is not None else None
+
+        with self._lock:
+            paths = [path for (path,) in self._conn.execute('SELECT path FROM entries')]
+
+        missing = [(path,) for path in paths
+                   if (folders is None or os.path.normpath(os.path.dirname(path)) in folders)
+                   and not os.path.exists(path)]
+
+        if missing:
+            with self._lock:
+                self._conn.executemany('DELETE FROM entries WHERE path = ?', missing)
+                self._conn.commit()
+
+        return len(missing)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _hit(self, value):
+        with self._lock:
+            self.hits += 1
+        return value
+
+
+class ResponseCache:
+    def __init__(self, name: str, max_bytes: int, db_path: str | None = None):
+        self.db_path = db_path or get_cache_path(f'{name}.sqlite3')
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS responses ('
+                           'key TEXT PRIMARY KEY, response TEXT, size INTEGER, last_access REAL)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)')
+        self._conn.commit()
+
+    @staticmethod
+    def get_key(model: str, options: dict, prompt: str) -> str:
+        prompt_hash = hashlib.sha256(prompt.encode('utf-8', errors='replace')).hexdigest()
+        return hashlib.sha256(json.dumps([model, options, prompt_hash], sort_keys=True).encode()).hexdigest()
+
+    def get(self, model: str, options: dict, prompt: str):
+        key = self.get_key(model, options, prompt)
+
+        with self._lock:
+            row = self._conn.execute('SELECT response FROM responses WHERE key = ?', (key,)).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._conn.execute('UPDATE responses SET last_access = ? WHERE key = ?', (time.time(), key))
+            self._conn.commit()
+
+        return row[0]
+
+    def put(self, model: str, options: dict, prompt: str, response: str):
+        key = self.get_key(model, options, prompt)
+        size = len(response.encode('utf-8', errors='replace'))
+
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO responses (key, response, size, last_access) '
+                               'VALUES (?, ?, ?, ?)', (key, response, size, time.time()))
+            self._evict()
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / total if total else 0.0}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _evict(self):
+        (total_size,) = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()
+        if total_size <= self.max_bytes:
+            return
+
+        # Least recently used responses go first until the cache fits again
+        rows = self._conn.execute('SELECT key, size FROM responses ORDER BY last_access').fetchall()
+        evicted = []
+        for key, size in rows:
+            if total_size <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total_size -= size
+
+        self._conn.executemany('DELETE FROM responses WHERE key = ?', evicted)
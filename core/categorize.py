@@ -1,27 +1,170 @@
+import asyncio
+import collections
+import re
 import core.keywords
 import core.prompts
 import core.llm_interaction
 
+CATEGORIZE_TOKEN_BUDGET = 6000
+CATEGORIZE_WORKERS = 2
+
 
 def categorize(df, use_keywords: bool = True, user_categories: list | None = None,
-               only_use_user_categories: bool = False, stream_callback=None, progress_callback=None):
-    if use_keywords and 'Keywords' not in df.columns:
-        df = core.keywords.get_keywords(df, progress_callback=progress_callback)
+               only_use_user_categories: bool = False, stream_callback=None, progress_callback=None,
+               only_uncategorized: bool = False, token_budget: int = CATEGORIZE_TOKEN_BUDGET,
+               max_workers: int = CATEGORIZE_WORKERS, compact: bool = True, result_callback=None,
+               timeout: float | None = None):
+    return core.llm_interaction.run_sync(categorize_async(df, use_keywords, user_categories, only_use_user_categories,
+                                                          stream_callback, progress_callback, only_uncategorized,
+                                                          token_budget, max_workers, compact, result_callback,
+                                                          timeout))
+
+
+async def categorize_async(df, use_keywords: bool = True, user_categories: list | None = None,
+                           only_use_user_categories: bool = False, stream_callback=None, progress_callback=None,
+                           only_uncategorized: bool = False, token_budget: int = CATEGORIZE_TOKEN_BUDGET,
+                           max_workers: int = CATEGORIZE_WORKERS, compact: bool = True, result_callback=None,
+                           timeout: float | None = None):
+    if only_uncategorized and 'LLM-Categorized' in df.columns:
+        return await _categorize_uncategorized(df, use_keywords, user_categories, only_use_user_categories,
+                                               stream_callback, progress_callback, token_budget, max_workers,
+                                               compact, result_callback, timeout)
+
+    if use_keywords and ('Keywords' not in df.columns or df['Keywords'].isna().any()):
+        df = await core.keywords.get_keywords_async(df, progress_callback=progress_callback, timeout=timeout)
+
+    # Estimating tokens for every row of a large folder takes a while, so chunking runs off the event loop
+    chunks = await asyncio.to_thread(_split_into_chunks, df, use_keywords, token_budget)
+    semaphore = asyncio.Semaphore(max(1, max_workers))
+
+    # Only the first chunk streams, so stream_callback shows one coherent response. Results from the other chunks
+    # are passed to result_callback as each chunk finishes
+    async def categorize_chunk(chunk, is_first):
+        async with semaphore:
+            assignments = await _categorize_chunk(chunk, use_keywords, user_categories, only_use_user_categories,
+                                                  compact, stream_callback if is_first else None,
+                                                  result_callback if is_first else None, timeout)
+
+        if result_callback and not is_first:
+            for filename, category in assignments.items():
+                result_callback(filename, category)
+
+        return assignments
+
+    chunk_assignments = await asyncio.gather(*[categorize_chunk(chunk, i == 0) for i, chunk in enumerate(chunks)])
+
+    assignments = {filename: category for assignments in chunk_assignments
+                   for filename, category in assignments.items()}
+
+    if len(chunks) > 1:
+        category_mapping = _merge_similar_categories(chunk_assignments, user_categories or [])
+        assignments = {filename: category_mapping[category] for filename, category in assignments.items()}
+
+    df['LLM-Categorized'] = df['Filename'].map(assignments).fillna('Other')
+
+    return df
+
+
+async def _categorize_chunk(df, use_keywords, user_categories, only_use_user_categories, compact,
+                            stream_callback=None, result_callback=None, timeout=None):
+    # Chunks run concurrently on a shared event loop, so their prompts are built off it
+    if compact:
+        prompt, encoding = await asyncio.to_thread(core.prompts.encode_categorize_prompt, df, use_keywords,
+                                                   user_categories, only_use_user_categories)
+        context_length = core.prompts.get_context_length(encoding.report.compact_tokens, len(df))
+    else:
+        prompt = await asyncio.to_thread(core.prompts.get_categorize_prompt, df, use_keywords, user_categories,
+                                         only_use_user_categories)
+        encoding = None
+        context_length = int(len(prompt) * 1.5)
+
+    def entry_callback(section, file_id, category):
+        if section == 'assignments' and isinstance(category, str):
+            result_callback(encoding.decode(file_id) if encoding else file_id, _clean_category(category))
+
+    json_response = await core.llm_interaction.prompt_llm_async(model=core.llm_interaction.LLM.DEEPSEEK.value,
+                                                                prompt=prompt,
+                                                                context_length=context_length,
+                                                                stream=True,
+                                                                stream_callback=stream_callback,
+                                                                entry_callback=entry_callback if result_callback
+                                                                else None,
+                                                                timeout=timeout)
+
+    assignments = (json_response or {}).get('assignments', {})
+    if encoding and isinstance(assignments, dict):
+        assignments = encoding.decode_keys(assignments)
+
+    return {filename: _clean_category(category) for filename, category in assignments.items()
+            if isinstance(category, str)}
+
+
+def _clean_category(category: str) -> str:
+    return category.replace('/', '-').replace('\\', '-')
+
+
+def _split_into_chunks(df, use_keywords, token_budget):
+    if use_keywords:
+        rows = df['Filename'] + ': ' + df['Keywords'].astype(str)
+    else:
+        rows = df['Filename']
+
+    row_tokens = rows.map(core.prompts.estimate_tokens).to_numpy()
+
+    chunks = []
+    start = 0
+    chunk_tokens = 0
+    for i, tokens in enumerate(row_tokens):
+        if chunk_tokens + tokens > token_budget and i > start:
+            chunks.append(df.iloc[start:i])
+            start = i
+            chunk_tokens = 0
+        chunk_tokens += tokens
+
+    chunks.append(df.iloc[start:])
+
+    return chunks
+
+
+# Only names that differ in case, plurals or punctuation are merged; names that merely look alike ('Contacts' and
+# 'Contracts') are different categories. User categories are never remapped, even onto each other.
+def _merge_similar_categories(chunk_assignments, user_categories) -> dict:
+    counts = collections.Counter(category for assignments in chunk_assignments for category in assignments.values())
+
+    canonical_categories = {}
+    mapping = {category: category for category in user_categories}
+
+    # User categories always win, then the categories used for the most files
+    for category in [*user_categories, *sorted(counts, key=counts.get, reverse=True)]:
+        canonical = canonical_categories.setdefault(_normalize_category(category), category)
+        mapping.setdefault(category, canonical)
+
+    return mapping
+
+
+def _normalize_category(category: str) -> str:
+    words = re.sub(r'[^a-z0-9]+', ' ', category.lower()).split()
+    return ' '.join(word[:-1] if len(word) > 3 and word.endswith('s') and not word.endswith('ss') else word
+                    for word in words)
 
-    prompt = core.prompts.get_categorize_prompt(df, use_keywords, user_categories, only_use_user_categories)
 
-    json_response = core.llm_interaction.prompt_llm(model=core.llm_interaction.LLM.DEEPSEEK.value,
-                                                    prompt=prompt,
-                                                    context_length=int(len(prompt) * 1.5),
-                                                    stream=True,
-                                                    stream_callback=stream_callback)
+async def _categorize_uncategorized(df, use_keywords, user_categories, only_use_user_categories, stream_callback,
+                                    progress_callback, token_budget, max_workers, compact, result_callback, timeout):
+    uncategorized = df['LLM-Categorized'].isna()
+    if not uncategorized.any():
+        return df
 
-    assignments = json_response.get('assignments', {})
+    # New files are steered towards the categories already in use so the folder stays consistent
+    existing_categories = df.loc[~uncategorized, 'LLM-Categorized'].unique().tolist()
+    user_categories = list(dict.fromkeys([*(user_categories or []), *existing_categories])) or None
 
-    cleaned_assignments = {
-        filename: category.replace('/', '-').replace('\\', '-') for filename, category in assignments.items()
-    }
+    categorized_df = await categorize_async(df[uncategorized].copy(), use_keywords, user_categories,
+                                            only_use_user_categories, stream_callback, progress_callback,
+                                            token_budget=token_budget, max_workers=max_workers, compact=compact,
+                                            result_callback=result_callback, timeout=timeout)
 
-    df['LLM-Categorized'] = df['Filename'].map(lambda filename: cleaned_assignments.get(filename, 'Other'))
+    for column in ['Keywords', 'LLM-Categorized']:
+        if column in categorized_df.columns:
+            df.loc[uncategorized, column] = categorized_df[column]
 
     return df
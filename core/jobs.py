@@ -0,0 +1,257 @@
+import asyncio
+import contextlib
+import pickle
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from typing import NamedTuple
+
+import core.cache
+from core import llm_interaction
+
+JOBS_NAME = 'jobs'
+JOB_WORKERS = 2
+PROGRESS_SAVE_INTERVAL = 2.0
+MAX_FINISHED_JOBS = 50
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+FINISHED_STATUSES = (DONE, FAILED, CANCELLED)
+
+
+class JobInfo(NamedTuple):
+    id: str
+    kind: str
+    status: str
+    progress: float
+    message: str
+    stream_text: str
+    result: object
+    error: str | None
+    created_at: float
+    started_at: float | None
+    finished_at: float | None
+
+
+# Handed to the job function as its first argument. set_progress and append_stream_text can be passed straight on
+# as the pipeline's progress and stream callbacks; they update memory and let the runner decide when to persist.
+# Streamed text is collected as chunks and only joined when someone reads it, so a token costs an append.
+class Job:
+    def __init__(self, job_id: str, kind: str, run, args, kwargs, on_update=None):
+        self.id = job_id
+        self.kind = kind
+        self.status = QUEUED
+        self.progress = 0.0
+        self.message = ''
+        self.created_at = time.time()
+        self.started_at = None
+
+        self._run = run
+        self._args = args
+        self._kwargs = kwargs
+        self._cancel_event = threading.Event()
+        self._loop = None
+        self._task = None
+        self._saved_at = 0.0
+        self._on_update = on_update
+        self._stream_text = ''
+        self._stream_chunks = []
+        self._stream_lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def set_progress(self, fraction: float, message: str | None = None):
+        self.progress = min(max(fraction, 0.0), 1.0)
+        if message is not None:
+            self.message = message
+        if self._on_update is not None:
+            self._on_update(self)
+
+    @property
+    def stream_text(self) -> str:
+        with self._stream_lock:
+            if self._stream_chunks:
+                self._stream_text += ''.join(self._stream_chunks)
+                self._stream_chunks.clear()
+            return self._stream_text
+
+    def append_stream_text(self, text: str):
+        with self._stream_lock:
+            self._stream_chunks.append(text)
+        if self._on_update is not None:
+            self._on_update(self)
+
+    # The event is set before the task is looked up, and _run_async stores the task before checking the event, so
+    # a cancel that races with the job starting is never lost
+    def _cancel(self):
+        self._cancel_event.set()
+        task, loop = self._task, self._loop
+        if task is not None and loop is not None:
+            with contextlib.suppress(RuntimeError):
+                loop.call_soon_threadsafe(task.cancel)
+
+    def get_info(self) -> JobInfo:
+        return JobInfo(self.id, self.kind, self.status, self.progress, self.message, self.stream_text, None, None,
+                       self.created_at, self.started_at, None)
+
+
+# Runs long LLM operations on worker threads so the caller (the Streamlit script) only submits and polls. A job function
+# may return a coroutine, which then runs on llm_interaction's shared background event loop (the 'llm-event-loop'
+# thread) and is cancelled as a task there, so cancelling a job also stops its in-flight generations. Every job shares
+# that loop, so job coroutines hand anything CPU or disk bound to asyncio.to_thread. State, progress and pickled results
+# are kept in SQLite, which lets a new session pick up the results of earlier ones; jobs that were still queued or
+# running when the process went away can't be resumed, since their functions don't survive it, and are marked as failed.
+class JobRunner:
+    def __init__(self, num_workers: int = JOB_WORKERS, db_path: str | None = None):
+        self.db_path = db_path or core.cache.get_cache_path(f'{JOBS_NAME}.sqlite3')
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                           'id TEXT PRIMARY KEY, kind TEXT, status TEXT, progress REAL, message TEXT, '
+                           'stream_text TEXT, result BLOB, error TEXT, created_at REAL, started_at REAL, '
+                           'finished_at REAL)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS jobs_kind_created_at ON jobs (kind, created_at)')
+        self._conn.execute('UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE status IN (?, ?)',
+                           (FAILED, 'Interrupted', time.time(), *ACTIVE_STATUSES))
+        self._conn.commit()
+
+        self._queue = queue.Queue()
+        self._jobs = {}
+        self._workers = [threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True)
+                         for i in range(max(1, num_workers))]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, kind: str, run, *args, **kwargs) -> str:
+        job = Job(uuid.uuid4().hex, kind, run, args, kwargs, on_update=self._save_progress)
+
+        with self._lock:
+            self._jobs[job.id] = job
+            self._save(job)
+        self._queue.put(job)
+
+        return job.id
+
+    # Jobs still in memory are read from there, so polling a running job doesn't touch the database. Results can be
+    # whole DataFrames, so they are only unpickled when asked for.
+    def get(self, job_id: str, include_result: bool = True) -> JobInfo | None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return job.get_info()
+
+            columns = 'result' if include_result else 'NULL'
+            row = self._conn.execute(f'SELECT id, kind, status, progress, message, stream_text, {columns}, error, '
+                                     'created_at, started_at, finished_at FROM jobs WHERE id = ?',
+                                     (job_id,)).fetchone()
+
+        if row is None:
+            return None
+        return JobInfo(*row[:6], pickle.loads(row[6]) if row[6] is not None else None, *row[7:])
+
+    def get_jobs(self, kind: str | None = None, limit: int = MAX_FINISHED_JOBS) -> list[JobInfo]:
+        with self._lock:
+            rows = self._conn.execute('SELECT id FROM jobs WHERE ? IS NULL OR kind = ? '
+                                      'ORDER BY created_at DESC LIMIT ?', (kind, kind, limit)).fetchall()
+
+        return [job for job in (self.get(job_id, include_result=False) for job_id, in rows) if job is not None]
+
+    def cancel(self, job_id: str) -> bool:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return False
+
+            job._cancel()
+            # Queued jobs are skipped by the worker that eventually takes them off the queue
+            if job.status == QUEUED:
+                self._finish(job, CANCELLED)
+
+        return True
+
+    def close(self):
+        for job_id in list(self._jobs):
+            self.cancel(job_id)
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._conn.close()
+
+    def _work(self):
+        while (job := self._queue.get()) is not None:
+            with self._lock:
+                if job.cancelled:
+                    continue
+                job.status = RUNNING
+                job.started_at = time.time()
+                self._save(job)
+
+            try:
+                result = job._run(job, *job._args, **job._kwargs)
+                if asyncio.iscoroutine(result):
+                    result = llm_interaction.run_sync(_run_async(job, result))
+                if job.cancelled:
+                    raise asyncio.CancelledError
+            except asyncio.CancelledError:
+                with self._lock:
+                    self._finish(job, CANCELLED)
+            except Exception as e:
+                with self._lock:
+                    self._finish(job, FAILED, error=f'{type(e).__name__}: {e}')
+            else:
+                try:
+                    pickled_result = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+                except Exception as e:
+                    pickled_result = None
+                    error = f'Result could not be saved: {e}'
+                else:
+                    error = None
+                with self._lock:
+                    job.progress = 1.0
+                    self._finish(job, FAILED if error else DONE, pickled_result, error)
+
+    def _finish(self, job, status, pickled_result=None, error=None):
+        job.status = status
+        self._save(job, pickled_result, error, finished_at=time.time())
+        del self._jobs[job.id]
+
+        self._conn.execute(f'DELETE FROM jobs WHERE status IN ({", ".join("?" * len(FINISHED_STATUSES))}) '
+                           'AND id NOT IN (SELECT id FROM jobs ORDER BY created_at DESC LIMIT ?)',
+                           (*FINISHED_STATUSES, MAX_FINISHED_JOBS))
+        self._conn.commit()
+
+    def _save(self, job, pickled_result=None, error=None, finished_at=None):
+        job._saved_at = time.monotonic()
+        self._conn.execute('INSERT OR REPLACE INTO jobs (id, kind, status, progress, message, stream_text, result, '
+                           'error, created_at, started_at, finished_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                           (job.id, job.kind, job.status, job.progress, job.message, job.stream_text,
+                            pickled_result, error, job.created_at, job.started_at, finished_at))
+        self._conn.commit()
+
+    # Updates are saved at most every PROGRESS_SAVE_INTERVAL, so streaming doesn't turn into a write per token
+    def _save_progress(self, job):
+        if time.monotonic() - job._saved_at >= PROGRESS_SAVE_INTERVAL:
+            with self._lock:
+                if job.id in self._jobs:
+                    self._save(job)
+
+
+async def _run_async(job, coroutine):
+    job._task = asyncio.current_task()
+    job._loop = asyncio.get_running_loop()
+    if job.cancelled:
+        coroutine.close()
+        raise asyncio.CancelledError
+
+    return await coroutine
@@ -0,0 +1,135 @@
+import json
+
+STREAMED_SECTIONS = ('assignments', 'deletions', 'results')
+THINK_START = '<think>'
+THINK_END = '</think>'
+
+
+# Parses a DeepSeek response as it streams in and emits each entry of the 'assignments', 'deletions' or
+# 'results' section as soon as it is complete. Everything before '</think>' and before the first '{' (such as a
+# ```json fence) is skipped, so `result` holds everything parsed so far even if the stream is cut off.
+class StreamingJSONParser:
+    def __init__(self, sections=STREAMED_SECTIONS):
+        self.sections = set(sections)
+        self.result = {}
+
+        self._state = 'preamble'
+        self._preamble = ''
+        self._think_tail = ''
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_chars = []
+        self._last_string = None
+        self._section = None
+        self._container = None
+        self._element_chars = []
+
+    def feed(self, text: str) -> list:
+        entries = []
+
+        if self._state == 'preamble':
+            self._preamble += text
+            stripped = self._preamble.lstrip()
+            if len(stripped) < len(THINK_START) and THINK_START.startswith(stripped):
+                return entries
+
+            self._state = 'thinking' if stripped.startswith(THINK_START) else 'json'
+            text = stripped[len(THINK_START):] if self._state == 'thinking' else stripped
+
+        if self._state == 'thinking':
+            # Keep a short tail so '</think>' is found even when it is split across chunks
+            window = self._think_tail + text
+            end = window.find(THINK_END)
+            if end == -1:
+                self._think_tail = window[-len(THINK_END):]
+                return entries
+
+            self._state = 'json'
+            text = window[end + len(THINK_END):]
+
+        if self._state == 'json':
+            for char in text:
+                self._feed_char(char, entries)
+
+        return entries
+
+    def _feed_char(self, char, entries):
+        capturing = self._section is not None
+
+        if self._in_string:
+            if capturing:
+                self._element_chars.append(char)
+            elif self._depth == 1:
+                self._string_chars.append(char)
+
+            if self._escape:
+                self._escape = False
+            elif char == '\\':
+                self._escape = True
+            elif char == '"':
+                self._in_string = False
+                if self._depth == 1 and not capturing:
+                    self._last_string = self._decode_string(''.join(self._string_chars[:-1]))
+            return
+
+        if self._depth == 0 and char != '{':
+            return
+
+        if char == '"':
+            self._in_string = True
+            self._string_chars = []
+            if capturing:
+                self._element_chars.append(char)
+
+        elif char in '{[':
+            self._depth += 1
+            if self._depth == 2 and self._last_string in self.sections:
+                self._section = self._last_string
+                self._container = char
+                self._element_chars = []
+                self.result[self._section] = {} if char == '{' else []
+            elif capturing:
+                self._element_chars.append(char)
+
+        elif char in '}]':
+            if capturing and self._depth == 2:
+                self._flush_element(entries)
+                self._section = None
+            elif capturing:
+                self._element_chars.append(char)
+            self._depth -= 1
+
+        elif char == ',' and capturing and self._depth == 2:
+            self._flush_element(entries)
+
+        elif capturing:
+            self._element_chars.append(char)
+
+    def _flush_element(self, entries):
+        element = ''.join(self._element_chars).strip()
+        self._element_chars = []
+        if not element:
+            return
+
+        try:
+            if self._container == '{':
+                items = json.loads('{' + element + '}').items()
+            else:
+                items = [(len(self.result[self._section]), json.loads(element))]
+        except json.JSONDecodeError:
+            return
+
+        for key, value in items:
+            if self._container == '{':
+                self.result[self._section][key] = value
+            else:
+                self.result[self._section].append(value)
+            entries.append((self._section, key, value))
+
+    @staticmethod
+    def _decode_string(raw: str) -> str:
+        try:
+            return json.loads(f'"{raw}"')
+        except json.JSONDecodeError:
+            return raw
@@ -1,13 +1,33 @@
 import pandas as pd
+import asyncio
+import atexit
+import codecs
+import collections
+import concurrent.futures
+import contextlib
+import io
+import itertools
 import json
+import mmap
+import multiprocessing
 import os
 import pathlib
+import threading
+import time
+import typing
+import core.cache
 import core.prompts
 import core.llm_interaction
 import PyPDF2
 import docx
+import openpyxl
 import csv
 
+try:
+    import resource
+except ImportError:
+    resource = None
+
 TEXT_BASED_FILETYPES = [
     '.doc', '.docx', '.pdf', '.txt', '.md', '.json', '.csv', '.xlsx', '.ppt', '.pptx',
     '.py', '.java', '.cpp', '.c', '.html', '.css', '.js', '.ts', '.sql', '.xml', '.yaml'
@@ -17,86 +37,512 @@ MAX_CONTENT_LENGTH = 1000
 KEYWORDS_CONTEXT_LENGTH = 10_000
 MAX_LINES = 20
 MAX_PDF_PAGES = 5
+MAX_JSON_PARSE_BYTES = 1024 * 1024
+MAX_DOCUMENT_BYTES = 50 * 1024 * 1024
+EXTRACT_DEADLINE_SECONDS = 5
+EXTRACT_TIMEOUT_SECONDS = 10
+MAX_EXTRACT_MEMORY_BYTES = 2 * 1024 * 1024 * 1024
 NUM_KEYWORDS = 5
 MAX_KEYWORDS_LENGTH = 200
+KEYWORDS_CACHE_NAME = 'keywords'
+LLM_WORKERS = 4
+PARSE_WORKERS = min(8, os.cpu_count() or 1)
+BATCH_TOKEN_BUDGET = 4000
+BATCH_RESPONSE_TOKENS_PER_FILE = 64
+QUEUE_SIZE_PER_LLM_WORKER = 4
+LOOKUP_BATCH_SIZE = 256
+
+# One process pool per worker count, shared by every call; see _get_process_pool
+_process_pools = {}
+_process_pools_lock = threading.Lock()
+# Pools still around when the interpreter tears down its modules fail to clean up after themselves
+atexit.register(_process_pools.clear)
+
+
+class _FileContent(typing.NamedTuple):
+    content: str
+    size: int
+    mtime: float
+    content_hash: str | None
 
 
-def get_keywords(df, progress_callback=None):
+def get_keywords(df, progress_callback=None, use_cache: bool = True, use_content_hash: bool = False,
+                 llm_workers: int = LLM_WORKERS, parse_workers: int = PARSE_WORKERS,
+                 batch: bool = False, batch_token_budget: int = BATCH_TOKEN_BUDGET, use_processes: bool = True,
+                 timeout: float | None = None):
+    return core.llm_interaction.run_sync(get_keywords_async(df, progress_callback, use_cache, use_content_hash,
+                                                            llm_workers, parse_workers, batch, batch_token_budget,
+                                                            use_processes, timeout))
+
+
+async def get_keywords_async(df, progress_callback=None, use_cache: bool = True, use_content_hash: bool = False,
+                             llm_workers: int = LLM_WORKERS, parse_workers: int = PARSE_WORKERS,
+                             batch: bool = False, batch_token_budget: int = BATCH_TOKEN_BUDGET,
+                             use_processes: bool = True, timeout: float | None = None):
+    cache = await asyncio.to_thread(core.cache.FileCache, KEYWORDS_CACHE_NAME) if use_cache else None
     keywords = {}
 
-    total = len(df)
-    for i, path in enumerate(df['Path']):
-        keywords[path] = _get_keywords(path)
+    # Rows carried over from a previous scan (see core.metadata.get_files_delta) already have keywords
+    missing = df['Keywords'].isna() if 'Keywords' in df.columns else pd.Series(True, index=df.index)
+    paths = list(dict.fromkeys(df.loc[missing, 'Path']))
+    total = int(missing.sum())
 
-        if progress_callback:
-            progress_callback(i + 1, total)
+    pipeline = _KeywordPipeline(cache, use_content_hash, llm_workers, parse_workers, batch, batch_token_budget,
+                                use_processes, timeout)
 
-    df['Keywords'] = df['Path'].map(keywords)
+    try:
+        # Results are consumed on the event loop's thread so progress_callback is never called from a worker thread
+        async with contextlib.aclosing(pipeline.run(paths)) as results:
+            async for path, path_keywords in results:
+                keywords[path] = path_keywords
+
+                if progress_callback:
+                    progress_callback(len(keywords), total, pipeline.get_stats())
+
+        df.loc[missing, 'Keywords'] = df.loc[missing, 'Path'].map(keywords)
+
+        # Evicting checks every cached path in the folder for existence, so it runs off the event loop
+        if cache:
+            await asyncio.to_thread(cache.evict_missing, {os.path.dirname(path) for path in df['Path']})
+    finally:
+        if cache:
+            await asyncio.to_thread(cache.close)
 
     return df
 
 
-def _get_keywords(path):
+# Extraction runs in a shared process pool and feeds a bounded queue that LLM worker tasks drain. When the LLM falls
+# behind the queue fills up and extraction pauses, so memory stays bounded and both stages stay busy.
+class _KeywordPipeline:
+    def __init__(self, cache, use_content_hash, llm_workers, parse_workers, batch, batch_token_budget,
+                 use_processes, timeout=None):
+        self.cache = cache
+        self.use_content_hash = use_content_hash
+        self.llm_workers = llm_workers
+        self.parse_workers = parse_workers
+        self.batch = batch
+        self.batch_token_budget = batch_token_budget
+        self.use_processes = use_processes
+        self.timeout = timeout
+
+        self.extracted = asyncio.Queue(maxsize=llm_workers * QUEUE_SIZE_PER_LLM_WORKER)
+        self.results = asyncio.Queue()
+
+        self._pool = None
+        self._counts = collections.Counter()
+        self._max_queue_size = 0
+        self._start_time = time.monotonic()
+
+    async def run(self, paths):
+        self._start_time = time.monotonic()
+
+        tasks = [asyncio.create_task(self._produce(paths))]
+        tasks += [asyncio.create_task(self._consume()) for _ in range(self.llm_workers)]
+
+        # The workers are cancelled once every path has a result, or when the caller stops early
+        try:
+            for _ in range(len(paths)):
+                yield await self.results.get()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def get_stats(self) -> dict:
+        elapsed = max(time.monotonic() - self._start_time, 1e-9)
+
+        stats = {
+            'extracted': self._counts['extracted'],
+            'prompted': self._counts['prompted'],
+            'extract_rate': self._counts['extracted'] / elapsed,
+            'prompt_rate': self._counts['prompted'] / elapsed,
+            'queue_size': self.extracted.qsize(),
+            'max_queue_size': self._max_queue_size,
+        }
+
+        return {**(self.cache.stats() if self.cache else {'hits': 0, 'misses': 0}), **stats}
+
+    async def _produce(self, paths):
+        in_flight = {}
+        # Extractions that timed out keep their worker busy until they finish, so they still count against the pool
+        overdue = set()
+        if self.use_processes:
+            self._pool = _get_process_pool(self.parse_workers)
+        else:
+            self._pool = concurrent.futures.ThreadPoolExecutor(self.parse_workers)
+
+        try:
+            for start in range(0, len(paths), LOOKUP_BATCH_SIZE):
+                # Lookups stat every file and, with use_content_hash, hash the ones that were touched, so they run
+                # off the event loop, a batch at a time
+                lookups = await asyncio.to_thread(self._lookup_batch, paths[start:start + LOOKUP_BATCH_SIZE])
+
+                for path, result, stat in lookups:
+                    if result is not None:
+                        self.results.put_nowait((path, result))
+                        continue
+
+                    # No more extractions than workers, so the timeout covers extracting the file rather than
+                    # waiting for a worker
+                    while len(in_flight) + len(overdue) >= self.parse_workers:
+                        await self._collect_extracted(in_flight, overdue)
+
+                    try:
+                        extraction = self._submit_extraction(path, stat)
+                    except Exception:
+                        self.results.put_nowait((path, 'Unknown'))
+                        continue
+
+                    future = asyncio.ensure_future(asyncio.wait_for(asyncio.wrap_future(extraction),
+                                                                    EXTRACT_TIMEOUT_SECONDS))
+                    in_flight[future] = path, extraction
+
+            while in_flight:
+                await self._collect_extracted(in_flight, overdue)
+        finally:
+            # On cancellation nobody needs the results; extractions that already started run to completion
+            for future, (_, extraction) in in_flight.items():
+                future.cancel()
+                extraction.cancel()
+            # Waiting for the pool here would block the event loop
+            if not self.use_processes:
+                self._pool.shutdown(wait=False)
+
+    def _lookup_batch(self, paths):
+        lookups = []
+        for path in paths:
+            try:
+                result, stat = _lookup_keywords(path, self.cache, self.use_content_hash)
+            except Exception:
+                result, stat = 'Unknown', None
+            lookups.append((path, result, stat))
+
+        return lookups
+
+    def _submit_extraction(self, path, stat):
+        args = (_extract_for_keywords, path, stat.st_size, stat.st_mtime, self.use_content_hash)
+
+        try:
+            return self._pool.submit(*args)
+        except concurrent.futures.BrokenExecutor:
+            # A worker that died (e.g. was killed for its memory use) takes the whole pool with it
+            if not self.use_processes:
+                raise
+            self._pool = _get_process_pool(self.parse_workers, replace=self._pool)
+            return self._pool.submit(*args)
+
+    async def _collect_extracted(self, in_flight, overdue):
+        overdue.difference_update([extraction for extraction in overdue if extraction.done()])
+        if not in_flight:
+            if overdue:
+                await asyncio.wait([asyncio.wrap_future(extraction) for extraction in overdue],
+                                   return_when=asyncio.FIRST_COMPLETED)
+            return
+
+        done, _ = await asyncio.wait(set(in_flight), return_when=asyncio.FIRST_COMPLETED)
+
+        for future in done:
+            path, extraction = in_flight.pop(future)
+            result = _get_result(future)
+            self._counts['extracted'] += 1
+            if not extraction.done():
+                overdue.add(extraction)
+
+            if isinstance(result, _FileContent):
+                # Waits while the LLM workers are behind, which is what pauses extraction
+                await self.extracted.put((path, result))
+                self._max_queue_size = max(self._max_queue_size, self.extracted.qsize())
+            else:
+                self.results.put_nowait((path, result))
+
+    async def _consume(self):
+        carried_item = None
+
+        while True:
+            item = carried_item or await self.extracted.get()
+            carried_item = None
+
+            batch = [item]
+            while self.batch:
+                try:
+                    next_item = self.extracted.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+
+                if not _fits_in_batch(batch, *next_item, self.batch_token_budget):
+                    carried_item = next_item
+                    break
+
+                batch.append(next_item)
+
+            try:
+                if self.batch:
+                    results = await _prompt_keywords_batch(batch, self.cache, self.timeout)
+                else:
+                    results = {item[0]: await _prompt_keywords(*item, self.cache, self.timeout)}
+            except Exception:
+                results = dict.fromkeys([path for path, _ in batch], 'Unknown')
+
+            self._counts['prompted'] += len(batch)
+
+            for path, path_keywords in results.items():
+                self.results.put_nowait((path, path_keywords))
+
+
+# A malformed PDF or workbook can make its parser allocate without bound; with a cap on the worker's address space
+# that ends in a MemoryError for that file instead of the machine swapping
+def _init_extract_worker():
+    if resource is None:
+        return
+
+    with contextlib.suppress(ValueError, OSError):
+        _, hard_limit = resource.getrlimit(resource.RLIMIT_AS)
+        if hard_limit == resource.RLIM_INFINITY or hard_limit > MAX_EXTRACT_MEMORY_BYTES:
+            resource.setrlimit(resource.RLIMIT_AS, (MAX_EXTRACT_MEMORY_BYTES, hard_limit))
+
+
+# Starting a process pool per call is slow, and forking from a process whose other threads (Streamlit, the job
+# runner, the service's event loop) may hold locks can deadlock the child, so workers come from a fork server, or are
+# spawned where there is none. The pools live as long as the process.
+def _get_process_pool(num_workers, replace=None):
+    with _process_pools_lock:
+        pool = _process_pools.get(num_workers)
+        if pool is None or pool is replace:
+            start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            pool = concurrent.futures.ProcessPoolExecutor(num_workers, mp_context=multiprocessing.get_context(
+                start_method), initializer=_init_extract_worker)
+            _process_pools[num_workers] = pool
+
+        return pool
+
+
+# Timed out extractions count as 'Unknown' too
+def _get_result(future):
+    try:
+        return future.result()
+    except Exception:
+        return 'Unknown'
+
+
+def _lookup_keywords(path, cache=None, use_content_hash: bool = False):
     if pathlib.Path(path).suffix not in TEXT_BASED_FILETYPES:
-        return 'N/A'
+        return 'N/A', None
 
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return 'Unknown', None
+
+    if cache:
+        cached_keywords = cache.get(path, stat.st_size, stat.st_mtime,
+                                    core.cache.hash_file if use_content_hash else None)
+        if cached_keywords is not None:
+            return cached_keywords, stat
+
+    return None, stat
+
+
+# Runs in the extraction process pool, so it must not touch the cache or anything else that can't be pickled
+def _extract_for_keywords(path, size, mtime, use_content_hash: bool = False):
     try:
         file_content = _extract_file_content(path)[:MAX_CONTENT_LENGTH]
     except:
         return 'Unknown'
 
+    return _FileContent(file_content, size, mtime, core.cache.hash_file(path) if use_content_hash else None)
+
+
+async def _prompt_keywords(path, file_content, cache=None, timeout: float | None = None):
     filename = os.path.basename(path)
 
-    prompt = core.prompts.get_keywords_prompt(filename, file_content, NUM_KEYWORDS)
-    response = core.llm_interaction.prompt_llm(
+    prompt = core.prompts.get_keywords_prompt(filename, file_content.content, NUM_KEYWORDS)
+    response = await core.llm_interaction.prompt_llm_async(
         model=core.llm_interaction.LLM.PHI.value,
         prompt=prompt,
         context_length=KEYWORDS_CONTEXT_LENGTH,
-        stream=False
+        stream=False,
+        timeout=timeout
+    )
+
+    keywords = _fix_keywords_response(response)
+
+    if cache:
+        await asyncio.to_thread(cache.put, path, file_content.size, file_content.mtime, keywords,
+                                file_content.content_hash)
+
+    return keywords
+
+
+async def _prompt_keywords_batch(batch, cache=None, timeout: float | None = None):
+    files = {os.path.basename(path): file_content.content for path, file_content in batch}
+
+    prompt = core.prompts.get_batch_keywords_prompt(files, NUM_KEYWORDS)
+    response = await core.llm_interaction.prompt_llm_async(
+        model=core.llm_interaction.LLM.PHI.value,
+        prompt=prompt,
+        context_length=max(KEYWORDS_CONTEXT_LENGTH,
+                           core.prompts.estimate_tokens(prompt) + BATCH_RESPONSE_TOKENS_PER_FILE * len(files)),
+        stream=False,
+        timeout=timeout
     )
 
-    return _fix_keywords_response(response)
+    batch_keywords = _parse_batch_keywords_response(response)
+
+    results = {}
+    answered = []
+    for path, file_content in batch:
+        keywords = batch_keywords.get(os.path.basename(path))
+
+        # Files the model skipped in its batch answer get their own request instead
+        if keywords is None:
+            results[path] = await _prompt_keywords(path, file_content, cache, timeout)
+            continue
+
+        results[path] = keywords
+        answered.append((path, file_content, keywords))
 
+    if cache:
+        await asyncio.to_thread(_put_batch_keywords, cache, answered)
+
+    return results
+
+
+def _put_batch_keywords(cache, answered):
+    for path, file_content, keywords in answered:
+        cache.put(path, file_content.size, file_content.mtime, keywords, file_content.content_hash)
+
+
+def _fits_in_batch(batch, path, file_content, batch_token_budget) -> bool:
+    filename = os.path.basename(path)
+    if any(os.path.basename(batch_path) == filename for batch_path, _ in batch):
+        return False
 
-def _extract_file_content(path: str) -> str:
+    batch_tokens = sum(core.prompts.estimate_tokens(content.content) for _, content in batch)
+    return batch_tokens + core.prompts.estimate_tokens(file_content.content) <= batch_token_budget
+
+
+def _parse_batch_keywords_response(response) -> dict:
+    json_part = response.replace('```json', '').replace('```', '')
+    json_part = json_part[json_part.find('{'):json_part.rfind('}') + 1]
+
+    try:
+        batch_keywords = json.loads(json_part)
+    except json.JSONDecodeError:
+        return {}
+
+    if not isinstance(batch_keywords, dict):
+        return {}
+
+    fixed_keywords = {}
+    for filename, keywords in batch_keywords.items():
+        if isinstance(keywords, list):
+            keywords = ', '.join(str(keyword) for keyword in keywords)
+        if isinstance(keywords, str):
+            fixed_keywords[filename] = _fix_keywords_response(keywords)
+
+    return fixed_keywords
+
+
+def _extract_file_content(path: str, max_chars: int = MAX_CONTENT_LENGTH) -> str:
     if not os.path.exists(path):
         raise FileNotFoundError(f"File not found: {path}")
 
     file_ext = path.split('.')[-1].lower()
 
+    # Extractors check the deadline between pages/rows/paragraphs and return whatever they have so far, well before
+    # the pipeline gives up on the file after EXTRACT_TIMEOUT_SECONDS
+    deadline = time.monotonic() + EXTRACT_DEADLINE_SECONDS
+
+    # Parsers of these formats read the whole file, however little of it is needed
+    if file_ext in {'xlsx', 'doc', 'docx', 'pdf'} and os.path.getsize(path) > MAX_DOCUMENT_BYTES:
+        raise ValueError(f"File too large to extract: {path}")
+
     if file_ext in {'txt', 'md', 'py', 'java', 'cpp', 'c', 'html', 'css', 'js', 'ts', 'sql', 'xml', 'yaml'}:
-        with open(path, 'r', encoding='utf-8') as f:
-            return '\n'.join(f.readline().strip() for _ in range(MAX_LINES))
+        lines = _read_text_prefix(path, max_chars).splitlines()[:MAX_LINES]
+        return '\n'.join(line.strip() for line in lines)
 
     elif file_ext == 'json':
+        if os.path.getsize(path) > MAX_JSON_PARSE_BYTES:
+            return _read_text_prefix(path, max_chars) + '...'
+
         with open(path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            return json.dumps(data, indent=4)[:1000] + '...' if len(json.dumps(data)) > 1000 else json.dumps(data,
-                                                                                                             indent=4)
+            content = json.dumps(json.load(f), indent=4)
+        return content[:max_chars] + '...' if len(content) > max_chars else content
 
     elif file_ext == 'csv':
-        with open(path, 'r', encoding='utf-8') as f:
-            return '\n'.join([','.join(row) for _, row in zip(range(MAX_LINES), csv.reader(f))])
+        lines = _read_text_prefix(path, max_chars).splitlines()
+        return '\n'.join([','.join(row) for _, row in zip(range(MAX_LINES), csv.reader(lines))])
 
     elif file_ext in {'xlsx'}:
-        df = pd.read_excel(path, sheet_name=None)
-        return '\n'.join([f"Sheet: {sheet}\n" + df[sheet].head(MAX_LINES).to_csv(index=False) for sheet in df])
+        return _extract_xlsx_content(path, max_chars, deadline)
 
     elif file_ext in {'doc', 'docx'}:
-        doc = docx.Document(path)
-        return '\n'.join([para.text for para in doc.paragraphs[:MAX_LINES]])
+        paragraphs = []
+        num_chars = 0
+        for para in docx.Document(path).paragraphs[:MAX_LINES]:
+            paragraphs.append(para.text)
+            num_chars += len(para.text) + 1
+            if num_chars >= max_chars or time.monotonic() > deadline:
+                break
+        return '\n'.join(paragraphs)
 
     elif file_ext == 'pdf':
         with open(path, 'rb') as f:
             reader = PyPDF2.PdfReader(f)
-            num_pages = min(len(reader.pages), MAX_PDF_PAGES)
-            return '\n'.join(
-                [reader.pages[i].extract_text() for i in range(num_pages) if reader.pages[i].extract_text()])
+
+            pages = []
+            num_chars = 0
+            for page in itertools.islice(reader.pages, MAX_PDF_PAGES):
+                text = page.extract_text()
+                if text:
+                    pages.append(text)
+                    num_chars += len(text) + 1
+                if num_chars >= max_chars or time.monotonic() > deadline:
+                    break
+            return '\n'.join(pages)
 
     else:
         raise ValueError(f"File type not supported yet: {file_ext}")
 
 
+def _read_text_prefix(path: str, max_chars: int) -> str:
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return ''
+
+        # A UTF-8 character is at most 4 bytes, so this is always enough for max_chars characters
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            prefix = mapped[:max_chars * 4]
+
+    # The incremental decoder tolerates a character cut in half at the end of the prefix
+    return codecs.getincrementaldecoder('utf-8')().decode(prefix, final=False)[:max_chars]
+
+
+def _extract_xlsx_content(path: str, max_chars: int, deadline: float) -> str:
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+
+    try:
+        sheets = []
+        num_chars = 0
+        for sheet in workbook.worksheets:
+            output = io.StringIO()
+            writer = csv.writer(output, lineterminator='\n')
+            for row in sheet.iter_rows(max_row=MAX_LINES + 1, values_only=True):
+                writer.writerow(['' if value is None else value for value in row])
+                if num_chars + output.tell() >= max_chars or time.monotonic() > deadline:
+                    break
+
+            sheets.append(f"Sheet: {sheet.title}\n" + output.getvalue())
+            num_chars += len(sheets[-1]) + 1
+            if num_chars >= max_chars or time.monotonic() > deadline:
+                break
+
+        return '\n'.join(sheets)
+    finally:
+        workbook.close()
+
+
 def _fix_keywords_response(response):
     if response.count(',') == NUM_KEYWORDS - 1 and len(response) <= MAX_KEYWORDS_LENGTH:
         return response
@@ -1,38 +1,290 @@
 import ollama
+import asyncio
+import concurrent.futures
+import contextlib
 import json
+import os
+import threading
+import time
+import weakref
+import core.cache
+import core.json_stream
 from enum import Enum
 
+OLLAMA_HOST = os.environ.get('OLLAMA_HOST')
+KEEP_ALIVE = '30m'
+REQUEST_TIMEOUT = 600
+LLM_PARALLEL = int(os.environ.get('OLLAMA_NUM_PARALLEL', 4))
+MAX_MODEL_WAIT_SECONDS = 10
+RESPONSE_CACHE_NAME = 'llm_responses'
+RESPONSE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+USE_RESPONSE_CACHE = not os.environ.get('LLM_FILE_MANAGER_NO_RESPONSE_CACHE')
+REPLAY_CHUNK_SIZE = 16
+
+_client = None
+_client_lock = threading.Lock()
+_async_clients = weakref.WeakKeyDictionary()
+_background_loop = None
+_response_cache = None
+
 
 class LLM(Enum):
     DEEPSEEK = 'deepseek-r1:14b'
     PHI = 'phi3:3.8b-mini-128k-instruct-q4_K_M'
 
 
-def prompt_llm(model: str, prompt: str, context_length: int, stream: bool = False, stream_callback=None):
+# Lets requests for the model that is already loaded run (up to max_parallel at once) and holds requests for
+# other models back until that model has no more queued work, so the server swaps models as rarely as possible.
+# Once a request for another model has waited max_model_wait seconds, the loaded model gets no new requests and
+# is swapped out when its running ones finish, so a steady stream of requests for one model (e.g. from several
+# clients) can't starve the other.
+# Requests run on the caller's thread (or event loop), which keeps stream callbacks where they were asked for.
+class ModelScheduler:
+    def __init__(self, max_parallel: int = LLM_PARALLEL, max_model_wait: float = MAX_MODEL_WAIT_SECONDS):
+        self.max_parallel = max_parallel
+        self.max_model_wait = max_model_wait
+        self.current_model = None
+        self.model_switches = 0
+
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiters = []
+
+    @contextlib.contextmanager
+    def acquire(self, model: str):
+        waiter = self._enqueue(_Waiter(model))
+        waiter.event.wait()
+
+        try:
+            yield
+        finally:
+            self._release()
+
+    @contextlib.asynccontextmanager
+    async def acquire_async(self, model: str):
+        waiter = self._enqueue(_Waiter(model, asyncio.get_running_loop()))
+
+        try:
+            await waiter.future
+        except BaseException:
+            # A cancelled request gives up its place in the queue, or its slot if it was granted in the meantime
+            with self._lock:
+                if not waiter.granted:
+                    self._waiters.remove(waiter)
+            if waiter.granted:
+                self._release()
+            raise
+
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _enqueue(self, waiter):
+        with self._lock:
+            self._waiters.append(waiter)
+            self._dispatch()
+        return waiter
+
+    def _release(self):
+        with self._lock:
+            self._active -= 1
+            self._dispatch()
+
+    def _dispatch(self):
+        while self._waiters and self._active < self.max_parallel:
+            model = self.current_model
+            other_waiter = next((waiter for waiter in self._waiters if waiter.model != model), None)
+            overdue = (other_waiter is not None
+                       and time.monotonic() - other_waiter.enqueued_at >= self.max_model_wait)
+
+            if model is None or (self._active == 0 and (overdue or all(waiter.model != model
+                                                                        for waiter in self._waiters))):
+                model = other_waiter.model if overdue else self._waiters[0].model
+            elif overdue:
+                return
+
+            waiter = next((waiter for waiter in self._waiters if waiter.model == model), None)
+            if waiter is None:
+                return
+
+            self._waiters.remove(waiter)
+            if model != self.current_model:
+                self.model_switches += self.current_model is not None
+                self.current_model = model
+            self._active += 1
+            waiter.grant()
+
+
+class _Waiter:
+    def __init__(self, model: str, loop=None):
+        self.model = model
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+        self.event = threading.Event() if loop is None else None
+        self.future = loop.create_future() if loop is not None else None
+        self._loop = loop
+
+    def grant(self):
+        self.granted = True
+        if self.event is not None:
+            self.event.set()
+        else:
+            # The scheduler is shared by threads and event loops, so the future is resolved on its own loop
+            self._loop.call_soon_threadsafe(lambda: self.future.done() or self.future.set_result(None))
+
+
+scheduler = ModelScheduler()
+
+
+def get_client() -> ollama.Client:
+    global _client
+
+    with _client_lock:
+        if _client is None:
+            _client = ollama.Client(host=OLLAMA_HOST, timeout=REQUEST_TIMEOUT)
+        return _client
+
+
+# httpx connections belong to the event loop that opened them, so every loop gets its own pooled client
+def get_async_client() -> ollama.AsyncClient:
+    loop = asyncio.get_running_loop()
+
+    with _client_lock:
+        if loop not in _async_clients:
+            _async_clients[loop] = ollama.AsyncClient(host=OLLAMA_HOST, timeout=REQUEST_TIMEOUT)
+        return _async_clients[loop]
+
+
+# The sync wrappers share one event loop that runs for the life of the process, so its pooled client and
+# connections are reused across calls just like prompt_llm's. Coroutines run on the loop's thread, and so do their
+# stream and progress callbacks.
+def run_sync(coroutine):
+    loop = _get_background_loop()
+
+    try:
+        running_loop = asyncio.get_running_loop()
+    except RuntimeError:
+        running_loop = None
+
+    # Blocking the background loop on itself would deadlock, so this runs on a loop of its own
+    if running_loop is loop:
+        with concurrent.futures.ThreadPoolExecutor(1) as pool:
+            return pool.submit(asyncio.run, _run_and_close_client(coroutine)).result()
+
+    future = asyncio.run_coroutine_threadsafe(coroutine, loop)
+    try:
+        return future.result()
+    except concurrent.futures.CancelledError:
+        # Callers expect what asyncio.run raises when the coroutine is cancelled
+        raise asyncio.CancelledError from None
+    except BaseException:
+        # e.g. a KeyboardInterrupt while waiting, which shouldn't leave the coroutine running
+        future.cancel()
+        raise
+
+
+def _get_background_loop():
+    global _background_loop
+
+    with _client_lock:
+        if _background_loop is None:
+            _background_loop = asyncio.new_event_loop()
+            threading.Thread(target=_background_loop.run_forever, name='llm-event-loop', daemon=True).start()
+        return _background_loop
+
+
+async def _run_and_close_client(coroutine):
+    try:
+        return await coroutine
+    finally:
+        with _client_lock:
+            client = _async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client._client.aclose()
+
+
+def get_response_cache() -> core.cache.ResponseCache:
+    global _response_cache
+
+    with _client_lock:
+        if _response_cache is None:
+            _response_cache = core.cache.ResponseCache(RESPONSE_CACHE_NAME, RESPONSE_CACHE_MAX_BYTES)
+        return _response_cache
+
+
+def warm_up(models: list[str] | None = None, background: bool = False):
+    models = models or [llm.value for llm in LLM]
+
+    def load_models():
+        for model in models:
+            try:
+                # An empty prompt only loads the model, and keep_alive pins it in memory
+                with scheduler.acquire(model):
+                    get_client().generate(model=model, prompt='', keep_alive=KEEP_ALIVE)
+            except Exception as e:
+                print(f'Failed to warm up {model}: {e}')
+
+    if background:
+        threading.Thread(target=load_models, daemon=True).start()
+    else:
+        load_models()
+
+
+def prompt_llm(model: str, prompt: str, context_length: int, stream: bool = False, stream_callback=None,
+               entry_callback=None, use_cache: bool | None = None, timeout: float | None = None):
+    return run_sync(prompt_llm_async(model, prompt, context_length, stream, stream_callback, entry_callback, use_cache,
+                                     timeout))
+
+
+async def prompt_llm_async(model: str, prompt: str, context_length: int, stream: bool = False, stream_callback=None,
+                           entry_callback=None, use_cache: bool | None = None, timeout: float | None = None):
+    options = {'temperature': 0, 'num_ctx': context_length}
+    use_cache = USE_RESPONSE_CACHE if use_cache is None else use_cache
+
+    # The response cache commits to SQLite on every lookup, so it is used off the event loop
+    cache = await asyncio.to_thread(get_response_cache) if use_cache else None
+    cached_response = await asyncio.to_thread(cache.get, model, options, prompt) if cache else None
+
     if not stream:
-        response = ollama.chat(
-            model=model,
-            messages=[{'role': 'user', 'content': prompt}],
-            options={'temperature': 0, 'num_ctx': context_length}
-        )
-        return response['message']['content']
-
-    stream_response = ollama.chat(
-        model=model,
-        messages=[{'role': 'user', 'content': prompt}],
-        options={'temperature': 0, 'num_ctx': context_length},
-        stream=True
-    )
+        if cached_response is not None:
+            return cached_response
+
+        async with scheduler.acquire_async(model):
+            response = await asyncio.wait_for(get_async_client().chat(
+                model=model,
+                messages=[{'role': 'user', 'content': prompt}],
+                options=options,
+                keep_alive=KEEP_ALIVE
+            ), timeout)
+
+        content = response['message']['content']
+        if cache:
+            await asyncio.to_thread(cache.put, model, options, prompt, content)
+        return content
+
+    parser = core.json_stream.StreamingJSONParser() if model == LLM.DEEPSEEK.value else None
+    chunks = []
 
-    full_response = ''
-    for chunk in stream_response:
-        text = chunk['message']['content']
-        full_response += text
-        if stream_callback:
-            if stream_callback == print:
-                print(text, end='', flush=True)
-            else:
-                stream_callback(full_response)
+    # Cached responses are replayed in small pieces so stream and entry callbacks see the same thing as a live run
+    if cached_response is not None:
+        for i in range(0, len(cached_response), REPLAY_CHUNK_SIZE):
+            _consume_chunk(cached_response[i:i + REPLAY_CHUNK_SIZE], chunks, parser, stream_callback, entry_callback)
+    else:
+        async with scheduler.acquire_async(model):
+            try:
+                await asyncio.wait_for(_consume_stream(model, prompt, options, chunks, parser, stream_callback,
+                                                       entry_callback), timeout)
+            except Exception:
+                # A stream that breaks off or times out part way still returns the entries that were complete
+                if not (parser and parser.result):
+                    raise
+                return parser.result
+
+    full_response = ''.join(chunks)
+
+    if cache and cached_response is None:
+        await asyncio.to_thread(cache.put, model, options, prompt, full_response)
 
     if model != LLM.DEEPSEEK.value:
         return full_response
@@ -40,5 +292,37 @@ def prompt_llm(model: str, prompt: str, context_length: int, stream: bool = Fals
     try:
         json_part = full_response.split('</think>')[1].replace('```json', '').replace('```', '')
         return json.loads(json_part)
-    except json.JSONDecodeError:
-        return None
+    except (json.JSONDecodeError, IndexError):
+        return parser.result or None
+
+
+async def _consume_stream(model, prompt, options, chunks, parser, stream_callback, entry_callback):
+    stream_response = await get_async_client().chat(
+        model=model,
+        messages=[{'role': 'user', 'content': prompt}],
+        options=options,
+        stream=True,
+        keep_alive=KEEP_ALIVE
+    )
+
+    # Closing the stream on cancellation or timeout drops the connection, which stops the generation on the server
+    async with contextlib.aclosing(stream_response):
+        async for chunk in stream_response:
+            _consume_chunk(chunk['message']['content'], chunks, parser, stream_callback, entry_callback)
+
+
+def _consume_chunk(text, chunks, parser, stream_callback, entry_callback):
+    chunks.append(text)
+
+    if parser:
+        for entry in parser.feed(text):
+            if entry_callback:
+                entry_callback(*entry)
+
+    # Callbacks get only the new text, which keeps streaming linear in the length of the response; callers that need
+    # the full text accumulate it themselves
+    if stream_callback:
+        if stream_callback == print:
+            print(text, end='', flush=True)
+        else:
+            stream_callback(text)
@@ -1,36 +1,174 @@
+import concurrent.futures
+import hashlib
 import os
-import pathlib
+import typing
+import dateutil.tz
+import numpy as np
 import pandas as pd
-import datetime
+import core.cache
 
+SCAN_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+SCAN_COLUMNS = ['Path', 'Filename', 'Type', 'Size', 'Size (Raw)', 'Last Modified', 'Last Modified (Raw)',
+                'Days Since Last Modified']
+SNAPSHOT_KEY_COLUMNS = ['Size (Raw)', 'Last Modified (Raw)']
+# Where the quarantine (see ui.file_interaction.QuarantineStore) stages deleted files that live on another device
+QUARANTINE_FOLDER_NAME = '.quarantine'
 
-def get_files_metadata(folder_path: str):
-    files = os.listdir(folder_path)
 
-    file_paths = [os.path.join(folder_path, f) for f in files if
-                  os.path.isfile(os.path.join(folder_path, f))]
+class FolderDelta(typing.NamedTuple):
+    df: pd.DataFrame
+    added: list[str]
+    removed: list[str]
+    modified: list[str]
+    renamed: dict[str, str]
 
-    file_names = [pathlib.Path(f).name for f in file_paths]
-    file_types = [pathlib.Path(f).suffix for f in file_paths]
-    file_sizes = [os.path.getsize(f) for f in file_paths]
-    last_modified_dates = [os.path.getmtime(f) for f in file_paths]
-    last_modified_dates_str = [datetime.datetime.fromtimestamp(date).strftime('%Y-%m-%d') for date in
-                               last_modified_dates]
+    @property
+    def changed(self):
+        return self.df[self.df['Path'].isin(set(self.added) | set(self.modified))].copy()
 
-    file_sizes_kb = [f'{size / 1024:,.2f} KB' for size in file_sizes]
-    days_since_last_modified = [(datetime.datetime.now() - datetime.datetime.fromtimestamp(date)).days for date in
-                                last_modified_dates]
+
+def get_files_metadata(folder_path: str, recursive: bool = False, max_workers: int = SCAN_WORKERS):
+    if recursive:
+        entries = sorted(_scan_tree(folder_path, max_workers))
+    else:
+        entries, _ = _scan_folder(folder_path)
+
+    file_paths, file_names, file_sizes, last_modified_dates = zip(*entries) if entries else ([], [], [], [])
+
+    file_names = pd.Series(file_names, dtype=object)
+    file_sizes = np.array(file_sizes, dtype=np.int64)
+    last_modified_dates = np.array(last_modified_dates, dtype=np.float64)
+
+    # Same suffix rules as pathlib: a leading dot (e.g. '.bashrc') or a trailing dot is not an extension.
+    # str.rfind is several times faster than a regex per name.
+    file_types = pd.Series([name[dot:] if 0 < (dot := name.rfind('.')) < len(name) - 1 else '' for name in file_names],
+                           dtype=object)
+
+    # gettz() loads /etc/localtime as a tzfile, which pandas converts vectorized; tzlocal() is converted one
+    # timestamp at a time and is only used where there is no tz file
+    local_timezone = dateutil.tz.gettz() or dateutil.tz.tzlocal()
+    local_dates = pd.to_datetime(last_modified_dates, unit='s', utc=True).tz_convert(local_timezone)
+    local_dates = local_dates.tz_localize(None)
+    last_modified_dates_str = np.datetime_as_string(local_dates.to_numpy(), unit='D')
+    days_since_last_modified = (pd.Timestamp.now() - local_dates).days
+
+    file_sizes_kb = pd.Series(file_sizes / 1024).map('{:,.2f} KB'.format)
 
     df = pd.DataFrame(
         data={
-            'Path': file_paths,
+            'Path': list(file_paths),
             'Filename': file_names,
             'Type': file_types,
             'Size': file_sizes_kb,
             'Size (Raw)': file_sizes,
             'Last Modified': last_modified_dates_str,
+            'Last Modified (Raw)': last_modified_dates,
             'Days Since Last Modified': days_since_last_modified,
         }
     )
 
     return df
+
+
+def get_files_delta(folder_path: str, recursive: bool = False, max_workers: int = SCAN_WORKERS) -> FolderDelta:
+    df = get_files_metadata(folder_path, recursive, max_workers)
+    previous_df = load_snapshot(folder_path, recursive)
+
+    if previous_df is None:
+        return FolderDelta(df, added=df['Path'].tolist(), removed=[], modified=[], renamed={})
+
+    merged_df = df[['Path', *SNAPSHOT_KEY_COLUMNS]].merge(previous_df[['Path', *SNAPSHOT_KEY_COLUMNS]], on='Path',
+                                                          how='outer', suffixes=('', ' (Previous)'), indicator=True)
+    previous_key_columns = [f'{column} (Previous)' for column in SNAPSHOT_KEY_COLUMNS]
+
+    added_df = merged_df[merged_df['_merge'] == 'left_only']
+    removed_df = merged_df[merged_df['_merge'] == 'right_only']
+    both_df = merged_df[merged_df['_merge'] == 'both']
+
+    is_modified = np.zeros(len(both_df), dtype=bool)
+    for column, previous_column in zip(SNAPSHOT_KEY_COLUMNS, previous_key_columns):
+        is_modified |= (both_df[column] != both_df[previous_column]).to_numpy()
+    modified = both_df.loc[is_modified, 'Path'].tolist()
+
+    # A rename keeps the file's size and mtime, so an unambiguous (size, mtime) match between a removed
+    # and an added path is treated as the same file
+    added_by_key = added_df.drop_duplicates(SNAPSHOT_KEY_COLUMNS, keep=False).set_index(SNAPSHOT_KEY_COLUMNS)
+    removed_by_key = removed_df.drop_duplicates(previous_key_columns, keep=False).set_index(previous_key_columns)
+    removed_by_key.index.names = SNAPSHOT_KEY_COLUMNS
+    renamed_df = removed_by_key[['Path']].join(added_by_key[['Path']], how='inner', lsuffix=' (Old)', rsuffix=' (New)')
+    renamed = dict(zip(renamed_df['Path (Old)'], renamed_df['Path (New)']))
+
+    renamed_targets = set(renamed.values())
+    added = [path for path in added_df['Path'] if path not in renamed_targets]
+    removed = [path for path in removed_df['Path'] if path not in renamed]
+
+    # Keywords, categories etc. from the last run carry over to unchanged and renamed files
+    derived_columns = [column for column in previous_df.columns if column not in SCAN_COLUMNS]
+    if derived_columns:
+        new_to_old = {new_path: old_path for old_path, new_path in renamed.items()}
+        source_paths = df['Path'].map(new_to_old).fillna(df['Path'])
+        carried_df = previous_df.set_index('Path')[derived_columns].reindex(source_paths)
+        carried_df.index = df.index
+        carried_df.loc[df['Path'].isin(modified)] = np.nan
+        df = pd.concat([df, carried_df], axis=1)
+
+    return FolderDelta(df, added=added, removed=removed, modified=modified, renamed=renamed)
+
+
+def save_snapshot(df, folder_path: str, recursive: bool = False):
+    df.to_pickle(_get_snapshot_path(folder_path, recursive))
+
+
+def load_snapshot(folder_path: str, recursive: bool = False):
+    snapshot_path = _get_snapshot_path(folder_path, recursive)
+    if not os.path.exists(snapshot_path):
+        return None
+
+    try:
+        return pd.read_pickle(snapshot_path)
+    except Exception:
+        return None
+
+
+def _get_snapshot_path(folder_path: str, recursive: bool) -> str:
+    folder_key = hashlib.sha1(f'{os.path.abspath(folder_path)}|{recursive}'.encode()).hexdigest()[:16]
+    return core.cache.get_cache_path(f'snapshot_{folder_key}.pkl')
+
+
+def _scan_folder(folder_path: str):
+    files = []
+    subfolders = []
+
+    with os.scandir(folder_path) as entries:
+        for entry in entries:
+            try:
+                if entry.is_file():
+                    stat = entry.stat()
+                    files.append((entry.path, entry.name, stat.st_size, stat.st_mtime))
+                elif entry.is_dir(follow_symlinks=False) and entry.name != QUARANTINE_FOLDER_NAME:
+                    subfolders.append(entry.path)
+            except OSError:
+                continue
+
+    return files, subfolders
+
+
+def _scan_tree(folder_path: str, max_workers: int):
+    files, subfolders = _scan_folder(folder_path)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as pool:
+        pending = {pool.submit(_scan_folder, subfolder) for subfolder in subfolders}
+
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                try:
+                    folder_files, subfolders = future.result()
+                except OSError:
+                    # Subfolders we are not allowed to read are skipped rather than failing the whole scan
+                    continue
+
+                files.extend(folder_files)
+                pending.update(pool.submit(_scan_folder, subfolder) for subfolder in subfolders)
+
+    return files
@@ -1,3 +1,56 @@
+import collections
+import re
+import textwrap
+import typing
+import pandas as pd
+
+CHARS_PER_TOKEN = 4
+THINKING_TOKEN_RESERVE = 4096
+RESPONSE_TOKENS_PER_FILE = 16
+CONTEXT_LENGTH_STEP = 4096
+MAX_TOKEN_REPORTS = 100
+
+# Words, number runs and punctuation are the units BPE tokenizers split on; long words cost about a token per
+# CHARS_PER_TOKEN characters
+TOKEN_PATTERN = re.compile(r'[A-Za-z]+|\d+|[^\sA-Za-z\d]')
+
+TOKEN_REPORTS = collections.deque(maxlen=MAX_TOKEN_REPORTS)
+
+
+class TokenReport(typing.NamedTuple):
+    name: str
+    verbose_tokens: int | None
+    compact_tokens: int
+
+    @property
+    def saved_tokens(self) -> int | None:
+        return self.verbose_tokens - self.compact_tokens if self.verbose_tokens is not None else None
+
+
+class PromptEncoding(typing.NamedTuple):
+    filenames: dict
+    report: TokenReport
+
+    def decode(self, file_id) -> str:
+        return self.filenames.get(str(file_id).strip(), file_id)
+
+    def decode_keys(self, mapping: dict) -> dict:
+        return {self.decode(file_id): value for file_id, value in mapping.items()}
+
+    def decode_list(self, file_ids: list) -> list:
+        return [self.decode(file_id) for file_id in file_ids]
+
+
+def estimate_tokens(text: str) -> int:
+    return sum(len(token) // CHARS_PER_TOKEN + 1 for token in TOKEN_PATTERN.findall(text)) + 1
+
+
+def get_context_length(prompt_tokens: int, num_files: int) -> int:
+    # Rounded up to a fixed step so similar prompts share a num_ctx and Ollama doesn't reload the model
+    context_length = prompt_tokens + THINKING_TOKEN_RESERVE + RESPONSE_TOKENS_PER_FILE * num_files
+    return -(-context_length // CONTEXT_LENGTH_STEP) * CONTEXT_LENGTH_STEP
+
+
 def get_keywords_prompt(filename: str, contents: str, num_keywords: int) -> str:
     prompt = f"""Please provide {num_keywords} keywords in a comma-separated list that describe the contents of this file ({filename}).
     If it's not possible, just reply with "Unknown". The file content is: {contents}"""
@@ -5,6 +58,29 @@ def get_keywords_prompt(filename: str, contents: str, num_keywords: int) -> str:
     return prompt
 
 
+def get_batch_keywords_prompt(files: dict, num_keywords: int) -> str:
+    files_str = '\n\n'.join([f'### {filename}\n{contents}' for filename, contents in files.items()])
+
+    prompt = f"""Please provide {num_keywords} keywords in a comma-separated list that describe the contents of each of the files below.
+    If it's not possible for a file, use "Unknown" as its keywords.
+
+    Return a JSON object with the following structure, with one entry per file:
+    ```json
+    {{
+        "filename1.ext": "keyword1, keyword2, ...",
+        "filename2.ext": "keyword1, keyword2, ...",
+        ...
+    }}
+    ```
+
+    Files:
+    {files_str}
+
+    Return only the JSON output."""
+
+    return prompt
+
+
 def get_categorize_prompt(df, use_keywords: bool = True, user_categories: list | None = None,
                           only_use_user_categories: bool = False) -> str:
     if use_keywords:
@@ -145,3 +221,163 @@ def get_search_prompt(df, query: str, max_results: int) -> str:
     """
 
     return prompt
+
+
+def encode_categorize_prompt(df, use_keywords: bool = True, user_categories: list | None = None,
+                             only_use_user_categories: bool = False):
+    file_ids, files_str = _encode_files(df, lambda row: _join_fields(row['Name'], row.get('Keywords')
+                                                                     if use_keywords else None))
+
+    prompt = f"""
+    Categorize the files in a user's Downloads folder using their names, extensions{' and keywords' if use_keywords else ''}.
+    Files are grouped by extension under [.ext] headers, one per line as `id name{': keywords' if use_keywords else ''}`.
+
+    Rules:
+    - Group similar file types (e.g. .png, .jpg -> "Images") and common patterns (installers, documents, spreadsheets, archives).
+    {'- Prefer keywords, when given, to infer meaning.' if use_keywords else ''}
+    - Be specific: create a category even if only a few files fit.
+    - Use "Other" when a file lacks context.
+    """
+
+    if user_categories:
+        if only_use_user_categories:
+            prompt += """
+    Only use these user categories, never create new ones, and never leave a file unassigned:
+    """
+        else:
+            prompt += """
+    User categories (use them when they fit, create better ones when needed, unused ones are fine):
+    """
+        prompt += '\n'.join(user_categories)
+
+    prompt += f"""
+
+    Files:
+    {files_str}
+
+    Return only a JSON object mapping every file id to its category:
+    {{"categories": ["Category 1", ...], "assignments": {{"1": "Category 1", ...}}}}
+    """
+
+    prompt = _compact_whitespace(prompt)
+    verbose_columns = ['Filename', 'Keywords'] if use_keywords else ['Filename']
+
+    return prompt, _make_encoding(file_ids, prompt, 'categorize', df, verbose_columns,
+                                  lambda empty_df: get_categorize_prompt(empty_df, use_keywords, user_categories,
+                                                                         only_use_user_categories))
+
+
+def encode_delete_prompt(df, duplicates, age_threshold_days, size_threshold_kb):
+    file_ids, files_str = _encode_files(df, lambda row: f"{row['Name']} {round(row['Size (Raw)'] / 1024)}KB "
+                                                        f"{row['Days Since Last Modified']}d")
+
+    filename_ids = {filename: file_id for file_id, filename in file_ids.items()}
+    duplicates_str = '\n'.join([','.join(filename_ids[filename] for filename in group if filename in filename_ids)
+                                for group in duplicates])
+
+    prompt = f"""
+    Identify files in a Downloads folder that are candidates for deletion.
+    Files are grouped by extension under [.ext] headers, one per line as `id name sizeKB ageDays`.
+
+    A file should be deleted if any of these apply:
+    - More than {age_threshold_days} days old
+    - Over {size_threshold_kb} KB
+    - Likely a single-use installer (e.g. 'wiztree_4_23_setup.exe')
+    - A duplicate of another file; only delete the secondary copy, usually marked with parentheses
+
+    Files:
+    {files_str}
+
+    Duplicate groups (file ids):
+    {duplicates_str or 'None'}
+
+    Return only a JSON object mapping each file id to delete to a short reason:
+    {{"deletions": {{"1": "reason", ...}}}}
+    """
+
+    prompt = _compact_whitespace(prompt)
+
+    return prompt, _make_encoding(file_ids, prompt, 'delete', df, ['Filename', 'Size', 'Days Since Last Modified'],
+                                  lambda empty_df: get_delete_prompt(empty_df, duplicates, age_threshold_days,
+                                                                     size_threshold_kb))
+
+
+def encode_search_prompt(df, query: str, max_results: int):
+    file_ids, files_str = _encode_files(df, lambda row: _join_fields(row['Name'], row.get('Keywords'),
+                                                                     row.get('LLM-Categorized'),
+                                                                     row.get('Last Modified')))
+
+    prompt = f"""
+    Find up to {max_results} files in a Downloads folder that best match the query "{query}".
+    Files are grouped by extension under [.ext] headers, one per line as `id name: keywords: category: last_modified`.
+    Keywords may be missing and categories are AI-generated. Return fewer results if only a few are relevant.
+
+    Files:
+    {files_str}
+
+    Return only a JSON object with the matching file ids, best match first:
+    {{"results": ["1", ...]}}
+    """
+
+    prompt = _compact_whitespace(prompt)
+
+    return prompt, _make_encoding(file_ids, prompt, 'search', df,
+                                  ['Filename', 'Keywords', 'LLM-Categorized', 'Last Modified'],
+                                  lambda empty_df: get_search_prompt(empty_df, query, max_results))
+
+
+def _encode_files(df, format_row):
+    names_and_types = df['Filename'].str.extract(r'^(.*?)((?<=.)\.[^.]+)?$')
+    rows_df = df.assign(Name=names_and_types[0], Extension=names_and_types[1].fillna('').str.lower())
+
+    file_ids = {}
+    lines = []
+
+    for extension, group_df in rows_df.groupby('Extension', sort=True):
+        lines.append(f'[{extension or "no extension"}]')
+        for row in group_df.to_dict('records'):
+            file_id = str(len(file_ids) + 1)
+            file_ids[file_id] = row['Filename']
+            lines.append(f'{file_id} {format_row(row)}')
+
+    return file_ids, '\n'.join(lines)
+
+
+def _join_fields(name, *fields) -> str:
+    fields = [str(field) for field in fields
+              if field is not None and field == field and str(field) not in {'', 'N/A', 'Unknown'}]
+    return ': '.join([name, *fields])
+
+
+def _compact_whitespace(prompt: str) -> str:
+    lines = textwrap.dedent(prompt).strip().splitlines()
+    return re.sub(r'\n{3,}', '\n\n', '\n'.join(line.strip() for line in lines))
+
+
+def _make_encoding(file_ids, prompt, name, df, verbose_columns, get_verbose_prompt) -> PromptEncoding:
+    compact_tokens = estimate_tokens(prompt)
+
+    # The report is only informational, so a verbose prompt that can't be estimated never stands in the way of
+    # the compact one
+    try:
+        verbose_tokens = _estimate_verbose_tokens(df, verbose_columns, get_verbose_prompt, prompt, compact_tokens)
+    except Exception:
+        return PromptEncoding(file_ids, TokenReport(name, None, compact_tokens))
+
+    report = TokenReport(name, verbose_tokens, compact_tokens)
+    TOKEN_REPORTS.append(report)
+
+    return PromptEncoding(file_ids, report)
+
+
+# The verbose prompt isn't rendered in full just to be measured: it is rendered without files and with a single
+# blank row to price its instructions and row format, and the fields of every row are estimated from their length
+# at the compact prompt's tokens per character
+def _estimate_verbose_tokens(df, columns, get_verbose_prompt, prompt, compact_tokens) -> int:
+    instruction_tokens = estimate_tokens(get_verbose_prompt(pd.DataFrame(columns=columns)))
+    row_format_tokens = estimate_tokens(get_verbose_prompt(pd.DataFrame({column: [''] for column in columns})))
+    row_format_tokens -= instruction_tokens
+
+    field_chars = sum(int(df[column].astype(str).str.len().sum()) for column in columns if column in df.columns)
+
+    return instruction_tokens + row_format_tokens * len(df) + round(field_chars * compact_tokens / max(len(prompt), 1))
@@ -1,18 +1,66 @@
-from core import categorize, prompts, llm_interaction
+import asyncio
+from core import categorize, prompts, llm_interaction, search_index
 
+SHORTLIST_SIZE = 50
+MIN_RELATIVE_SCORE = 0.3
 
-def search(df, query: str, max_results: int, stream_callback=None):
-    if 'LLM-Categorized' not in df.columns:
-        df = categorize.categorize(df)
 
-    prompt = prompts.get_search_prompt(df, query, max_results)
+def search(df, query: str, max_results: int, stream_callback=None, use_llm: bool = True,
+           shortlist_size: int = SHORTLIST_SIZE, compact: bool = True, result_callback=None,
+           timeout: float | None = None):
+    return llm_interaction.run_sync(search_async(df, query, max_results, stream_callback, use_llm, shortlist_size,
+                                                 compact, result_callback, timeout))
 
-    json_response = llm_interaction.prompt_llm(
+
+async def search_async(df, query: str, max_results: int, stream_callback=None, use_llm: bool = True,
+                       shortlist_size: int = SHORTLIST_SIZE, compact: bool = True, result_callback=None,
+                       timeout: float | None = None):
+    if use_llm and 'LLM-Categorized' not in df.columns:
+        df = await categorize.categorize_async(df, timeout=timeout)
+
+    if df.empty:
+        return []
+
+    # Fitting the index for a large folder takes a while, and scoring it is a sparse product over every file, so
+    # both run off the event loop
+    index = await asyncio.to_thread(search_index.get_index, df)
+    positions, scores = await asyncio.to_thread(index.search, query, max_results if not use_llm else shortlist_size)
+
+    # Without the LLM to rerank, weak partial matches (e.g. 'fin' in 'final' for 'finance') are dropped
+    if not use_llm:
+        is_relevant = (scores > 0) & (scores >= scores.max(initial=0) * MIN_RELATIVE_SCORE)
+        results = df['Filename'].iloc[positions[is_relevant]].tolist()
+        if result_callback:
+            for filename in results:
+                result_callback(filename)
+        return results
+
+    shortlist_df = df.iloc[positions]
+
+    if compact:
+        prompt, encoding = prompts.encode_search_prompt(shortlist_df, query, max_results)
+        context_length = prompts.get_context_length(encoding.report.compact_tokens, max_results)
+    else:
+        prompt = prompts.get_search_prompt(shortlist_df, query, max_results)
+        encoding = None
+        context_length = int(len(prompt) * 1.5)
+
+    def entry_callback(section, _, file_id):
+        if section == 'results':
+            result_callback(encoding.decode(file_id) if encoding else file_id)
+
+    json_response = await llm_interaction.prompt_llm_async(
         model=llm_interaction.LLM.DEEPSEEK.value,
         prompt=prompt,
-        context_length=int(len(prompt) * 1.5),
+        context_length=context_length,
         stream=True,
-        stream_callback=stream_callback
+        stream_callback=stream_callback,
+        entry_callback=entry_callback if result_callback else None,
+        timeout=timeout
     )
 
-    return json_response.get('results', [])
+    results = (json_response or {}).get('results', [])
+    if encoding and isinstance(results, list):
+        results = encoding.decode_list(results)
+
+    return results
@@ -0,0 +1,116 @@
+import hashlib
+import os
+import pickle
+import re
+import threading
+import numpy as np
+import pandas as pd
+import scipy.sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+import core.cache
+
+INDEX_FILENAME = 'search_index.pkl'
+DOCUMENT_COLUMNS = ['Filename', 'Keywords', 'LLM-Categorized']
+MAX_INDEXES_IN_MEMORY = 4
+IGNORED_KEYWORDS = {'N/A', 'Unknown'}
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+class SearchIndex:
+    def __init__(self, documents: list[str]):
+        self.word_vectorizer = TfidfVectorizer(sublinear_tf=True, token_pattern=r'(?u)\b\w+\b')
+        self.char_vectorizer = TfidfVectorizer(analyzer='char_wb', ngram_range=(3, 4), sublinear_tf=True)
+
+        self.matrix = scipy.sparse.hstack([
+            self.word_vectorizer.fit_transform(documents),
+            self.char_vectorizer.fit_transform(documents)
+        ]).tocsr()
+
+    def search(self, query: str, top_k: int):
+        query_document = _to_document(query)
+        query_vector = scipy.sparse.hstack([
+            self.word_vectorizer.transform([query_document]),
+            self.char_vectorizer.transform([query_document])
+        ]).tocsr()
+
+        scores = (self.matrix @ query_vector.T).toarray().ravel()
+
+        top_k = min(top_k, len(scores))
+        if top_k == 0:
+            return np.array([], dtype=int), scores
+
+        top_positions = np.argpartition(-scores, top_k - 1)[:top_k]
+        top_positions = top_positions[np.argsort(-scores[top_positions], kind='stable')]
+
+        return top_positions, scores[top_positions]
+
+
+# The index is keyed on a vectorized hash of the columns documents are made of, so a warm query doesn't have to
+# build every document again just to find its index
+def get_index(df) -> SearchIndex:
+    key = get_index_key(df)
+
+    with _indexes_lock:
+        if key in _indexes:
+            return _indexes[key]
+
+    index = _load_index(key)
+    if index is None:
+        index = SearchIndex(get_documents(df))
+        _save_index(key, index)
+
+    with _indexes_lock:
+        if len(_indexes) >= MAX_INDEXES_IN_MEMORY:
+            _indexes.pop(next(iter(_indexes)))
+        _indexes[key] = index
+
+    return index
+
+
+def get_index_key(df) -> str:
+    columns = [column for column in DOCUMENT_COLUMNS if column in df.columns]
+    row_hashes = pd.util.hash_pandas_object(df[columns], index=False).to_numpy()
+
+    return hashlib.sha1(f'{columns}'.encode() + row_hashes.tobytes()).hexdigest()
+
+
+def get_documents(df) -> list[str]:
+    documents = df['Filename'].map(_to_document)
+
+    for column in ['Keywords', 'LLM-Categorized']:
+        if column in df.columns:
+            values = df[column].where(df[column].notna() & ~df[column].isin(IGNORED_KEYWORDS), '')
+            documents = documents + ' ' + values.astype(str).map(_to_document)
+
+    return documents.tolist()
+
+
+def _to_document(text: str) -> str:
+    text = re.sub(r'([a-z])([A-Z])', r'\1 \2', text)
+    return re.sub(r'[\W_]+', ' ', text).strip().lower()
+
+
+def _load_index(key: str):
+    index_path = core.cache.get_cache_path(INDEX_FILENAME)
+    if not os.path.exists(index_path):
+        return None
+
+    try:
+        with open(index_path, 'rb') as f:
+            saved_key, index = pickle.load(f)
+    except Exception:
+        return None
+
+    return index if saved_key == key else None
+
+
+def _save_index(key: str, index: SearchIndex):
+    index_path = core.cache.get_cache_path(INDEX_FILENAME)
+    temp_path = f'{index_path}.{os.getpid()}.tmp'
+
+    with open(temp_path, 'wb') as f:
+        pickle.dump((key, index), f)
+
+    os.replace(temp_path, index_path)
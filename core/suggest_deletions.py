@@ -1,37 +1,198 @@
-import collections
+import asyncio
+import concurrent.futures
+import os
+import numpy as np
+import pandas as pd
+import core.cache
 import core.prompts
 import core.llm_interaction
 
+HASH_WORKERS = min(8, os.cpu_count() or 1)
+PARTIAL_HASHES_CACHE_NAME = 'partial_hashes'
+FULL_HASHES_CACHE_NAME = 'hashes'
+INSTALLER_TYPES = {'.exe', '.msi', '.dmg', '.pkg', '.deb', '.rpm', '.appimage'}
+INSTALLER_NAME_PATTERN = r'setup|install|update|(?:^|[\W_])(?:x64|x86|win64|win32|amd64)(?:[\W_]|$)'
+COPY_PATTERN = r'(?:\s?\(\d+\)|\s-\sCopy(?:\s\(\d+\))?)(?:\.[^.]*)?$'
 
-def suggest_deletions(df, age_threshold_days: int, size_threshold_kb: int, stream_callback=None):
-    duplicates = find_duplicates(df)
 
-    prompt = core.prompts.get_delete_prompt(df, duplicates, age_threshold_days, size_threshold_kb)
+def suggest_deletions(df, age_threshold_days: int, size_threshold_kb: int, stream_callback=None,
+                      use_rules: bool = True, compact: bool = True, result_callback=None,
+                      timeout: float | None = None):
+    return core.llm_interaction.run_sync(suggest_deletions_async(df, age_threshold_days, size_threshold_kb,
+                                                                 stream_callback, use_rules, compact, result_callback,
+                                                                 timeout))
 
-    json_response = core.llm_interaction.prompt_llm(
+
+async def suggest_deletions_async(df, age_threshold_days: int, size_threshold_kb: int, stream_callback=None,
+                                  use_rules: bool = True, compact: bool = True, result_callback=None,
+                                  timeout: float | None = None):
+    # Hashing is disk bound and runs in its own thread pool, so the event loop stays free meanwhile
+    duplicates = await asyncio.to_thread(find_duplicates, df)
+
+    if use_rules:
+        decisions, reasons = await asyncio.to_thread(_apply_rules, df, duplicates, age_threshold_days,
+                                                     size_threshold_kb)
+    else:
+        decisions = pd.Series(None, index=df.index, dtype=object)
+        reasons = pd.Series('', index=df.index)
+
+    is_ambiguous = decisions.isna()
+    df['LLM-Delete'] = decisions.fillna('Keep')
+    df['LLM-Delete-Reason'] = reasons.where(~is_ambiguous, '')
+    df['Delete-Engine'] = np.where(is_ambiguous, 'LLM', 'Rules')
+
+    if result_callback:
+        is_rule_deletion = df['LLM-Delete'] == 'Delete'
+        for filename, reason in zip(df.loc[is_rule_deletion, 'Filename'], reasons[is_rule_deletion]):
+            result_callback(filename, reason)
+
+    if not is_ambiguous.any():
+        return df
+
+    ambiguous_df = df[is_ambiguous]
+    ambiguous_filenames = set(ambiguous_df['Filename'])
+    ambiguous_duplicates = [group for group in duplicates if ambiguous_filenames.intersection(group)]
+
+    # Without the rules every file goes to the LLM, so the prompt can be large and is built off the event loop
+    if compact:
+        prompt, encoding = await asyncio.to_thread(core.prompts.encode_delete_prompt, ambiguous_df,
+                                                   ambiguous_duplicates, age_threshold_days, size_threshold_kb)
+        context_length = core.prompts.get_context_length(encoding.report.compact_tokens, len(ambiguous_df))
+    else:
+        prompt = await asyncio.to_thread(core.prompts.get_delete_prompt, ambiguous_df, ambiguous_duplicates,
+                                         age_threshold_days, size_threshold_kb)
+        encoding = None
+        context_length = int(len(prompt) * 1.5)
+
+    def entry_callback(section, file_id, reason):
+        if section == 'deletions':
+            result_callback(encoding.decode(file_id) if encoding else file_id, reason)
+
+    json_response = await core.llm_interaction.prompt_llm_async(
         model=core.llm_interaction.LLM.DEEPSEEK.value,
         prompt=prompt,
-        context_length=int(len(prompt) * 1.5),
+        context_length=context_length,
         stream=True,
-        stream_callback=stream_callback
+        stream_callback=stream_callback,
+        entry_callback=entry_callback if result_callback else None,
+        timeout=timeout
     )
 
-    deletion_suggestions = json_response.get('deletions', {})
+    deletion_suggestions = (json_response or {}).get('deletions', {})
+    if encoding and isinstance(deletion_suggestions, dict):
+        deletion_suggestions = encoding.decode_keys(deletion_suggestions)
 
-    df['LLM-Delete'] = df['Filename'].apply(lambda filename: 'Delete' if filename in deletion_suggestions else 'Keep')
-
-    df['LLM-Delete-Reason'] = df.apply(
-        lambda row: deletion_suggestions[row['Filename']] if row['LLM-Delete'] == 'Delete' else '', axis=1)
+    llm_reasons = ambiguous_df['Filename'].map(deletion_suggestions)
+    df.loc[is_ambiguous, 'LLM-Delete'] = np.where(llm_reasons.notna(), 'Delete', 'Keep')
+    df.loc[is_ambiguous, 'LLM-Delete-Reason'] = llm_reasons.fillna('').astype(str)
 
     return df
 
 
-def find_duplicates(df):
-    potential_duplicates = collections.defaultdict(list)
+def _apply_rules(df, duplicates, age_threshold_days, size_threshold_kb):
+    filenames = df['Filename']
+    lowercase_filenames = filenames.str.lower()
+
+    is_old = df['Days Since Last Modified'] > age_threshold_days
+    is_large = df['Size (Raw)'] > size_threshold_kb * 1024
+
+    is_installer_type = df['Type'].str.lower().isin(INSTALLER_TYPES)
+    has_installer_name = lowercase_filenames.str.contains(INSTALLER_NAME_PATTERN, regex=True)
+    is_installer = is_installer_type & has_installer_name
+
+    duplicate_of, is_ambiguous_duplicate = _classify_duplicates(filenames, duplicates)
+
+    reasons = pd.Series('', index=df.index)
+    for applies, reason in [
+        (is_old, pd.Series(f'More than {age_threshold_days} days old', index=df.index)),
+        (is_large, pd.Series(f'Over {size_threshold_kb} KB', index=df.index)),
+        (is_installer, pd.Series('Single-use installer', index=df.index)),
+        (duplicate_of.notna(), 'Duplicate of ' + duplicate_of.fillna('')),
+    ]:
+        reasons = reasons.where(~applies, reasons + np.where(reasons == '', '', '; ') + reason)
+
+    # Executables without a telling name, and duplicate groups where the secondary copy can't be told apart
+    # by name, are left for the LLM to judge
+    is_ambiguous = (reasons == '') & ((is_installer_type & ~has_installer_name) | is_ambiguous_duplicate)
+
+    decisions = pd.Series(np.where(reasons != '', 'Delete', 'Keep'), index=df.index, dtype=object)
+    decisions[is_ambiguous] = None
+    reasons = reasons.where(reasons != '', 'Within age and size thresholds')
+
+    return decisions, reasons
+
+
+def _classify_duplicates(filenames, duplicates):
+    if not duplicates:
+        return pd.Series(None, index=filenames.index, dtype=object), pd.Series(False, index=filenames.index)
+
+    groups = pd.DataFrame([(filename, i) for i, group in enumerate(duplicates) for filename in group],
+                          columns=['Filename', 'Group']).drop_duplicates('Filename')
+
+    is_copy = groups['Filename'].str.contains(COPY_PATTERN, regex=True)
+    originals = groups[~is_copy].groupby('Group')['Filename']
+    groups['Original'] = groups['Group'].map(originals.first())
+    groups['Originals'] = groups['Group'].map(originals.size()).fillna(0)
+
+    groups['Duplicate Of'] = groups['Original'].where(is_copy & (groups['Originals'] >= 1))
+    groups['Ambiguous'] = (~is_copy & (groups['Originals'] > 1)) | (groups['Originals'] == 0)
+
+    groups = groups.set_index('Filename')
+    duplicate_of = filenames.map(groups['Duplicate Of'])
+    is_ambiguous = filenames.map(groups['Ambiguous']).eq(True)
+
+    return duplicate_of, is_ambiguous
+
+
+def find_duplicates(df, max_workers: int = HASH_WORKERS, use_cache: bool = True):
+    candidates = df[df.duplicated('Size (Raw)', keep=False) & (df['Size (Raw)'] > 0)]
+    if candidates.empty:
+        return []
+
+    partial_cache = core.cache.FileCache(PARTIAL_HASHES_CACHE_NAME) if use_cache else None
+    full_cache = core.cache.FileCache(FULL_HASHES_CACHE_NAME) if use_cache else None
+
+    def get_hashes(candidates, hash_fn, cache):
+        mtimes = candidates['Last Modified (Raw)'] if 'Last Modified (Raw)' in candidates.columns \
+            else [None] * len(candidates)
+        return list(pool.map(lambda args: _get_hash(*args, hash_fn, cache),
+                             zip(candidates['Path'], candidates['Size (Raw)'], mtimes)))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as pool:
+        # The first and last few KB rule out most same-size files without reading them in full
+        candidates = candidates.assign(Hash=get_hashes(candidates, core.cache.hash_file_edges, partial_cache))
+        candidates = candidates[candidates['Hash'].notna() & candidates.duplicated(['Size (Raw)', 'Hash'], keep=False)]
+
+        # Small files were already hashed in full by the edge hash
+        is_large = candidates['Size (Raw)'] > 2 * core.cache.EDGE_HASH_SIZE
+        if is_large.any():
+            candidates.loc[is_large, 'Hash'] = get_hashes(candidates[is_large], core.cache.hash_file, full_cache)
+            candidates = candidates[candidates['Hash'].notna()
+                                    & candidates.duplicated(['Size (Raw)', 'Hash'], keep=False)]
+
+    for cache in [partial_cache, full_cache]:
+        if cache:
+            cache.evict_missing({os.path.dirname(path) for path in df['Path']})
+            cache.close()
+
+    return candidates.groupby(['Size (Raw)', 'Hash'], sort=False)['Filename'].agg(list).tolist()
+
+
+def _get_hash(path, size, mtime, hash_fn, cache=None):
+    try:
+        if mtime is None:
+            mtime = os.stat(path).st_mtime
+
+        if cache:
+            cached_hash = cache.get(path, size, mtime)
+            if cached_hash is not None:
+                return cached_hash
+
+        file_hash = hash_fn(path)
+    except OSError:
+        return None
 
-    for index, row in df.iterrows():
-        key = (row['Size (Raw)'], row['Type'])
-        potential_duplicates[key].append(row['Filename'])
+    if cache:
+        cache.put(path, size, mtime, file_hash)
 
-    duplicates = [files for files in potential_duplicates.values() if len(files) > 1]
-    return duplicates
+    return file_hash
@@ -0,0 +1,138 @@
+import ctypes
+import ctypes.util
+import os
+import sys
+import threading
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC if hasattr(os, 'O_CLOEXEC') else 0
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF)
+EVENT_BUFFER_SIZE = 64 * 1024
+
+
+# Tells whether a folder may have changed since the last reset(), so callers can skip rescanning it.
+# Uses inotify on Linux and falls back to polling the size and mtime of every entry elsewhere, or when the folder
+# can't be watched (e.g. the fs.inotify.max_user_watches limit is reached).
+class FolderWatcher:
+    def __init__(self, folder_path: str, recursive: bool = False):
+        self.folder_path = folder_path
+        self.recursive = recursive
+        self._fd = None
+        self._signature = None
+        self._version = 0
+        self._lock = threading.Lock()
+        self._libc = _load_libc()
+        self.reset()
+
+    @property
+    def uses_inotify(self) -> bool:
+        return self._fd is not None
+
+    def has_changes(self) -> bool:
+        if self._fd is not None:
+            try:
+                return bool(os.read(self._fd, EVENT_BUFFER_SIZE))
+            except BlockingIOError:
+                return False
+
+        return _get_signature(self.folder_path, self.recursive) != self._signature
+
+    # Counts the changes seen so far, so one watcher can be shared: each caller keeps the last version it saw
+    # instead of resetting the watcher for everyone
+    def get_version(self) -> int:
+        with self._lock:
+            if self._fd is not None:
+                changed = False
+                try:
+                    while os.read(self._fd, EVENT_BUFFER_SIZE):
+                        changed = True
+                except BlockingIOError:
+                    pass
+            else:
+                signature = _get_signature(self.folder_path, self.recursive)
+                changed = signature != self._signature
+                self._signature = signature
+
+            if changed:
+                self._version += 1
+            return self._version
+
+    def reset(self):
+        self.close()
+
+        if self._libc is not None:
+            fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd >= 0:
+                if all(self._libc.inotify_add_watch(fd, os.fsencode(folder), WATCH_MASK) >= 0
+                       for folder in _iter_folders(self.folder_path, self.recursive)):
+                    self._fd = fd
+                    return
+                # A folder without a watch would never report changes
+                os.close(fd)
+
+        self._signature = _get_signature(self.folder_path, self.recursive)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _load_libc():
+    if not sys.platform.startswith('linux'):
+        return None
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+
+    return libc
+
+
+def _iter_folders(folder_path: str, recursive: bool):
+    yield folder_path
+
+    if not recursive:
+        return
+
+    for root, folders, _ in os.walk(folder_path):
+        for folder in folders:
+            yield os.path.join(root, folder)
+
+
+def _get_signature(folder_path: str, recursive: bool):
+    signature = set()
+
+    for folder in _iter_folders(folder_path, recursive):
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    try:
+                        stat = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    signature.add((entry.path, stat.st_size, stat.st_mtime_ns))
+        except OSError:
+            continue
+
+    return frozenset(signature)
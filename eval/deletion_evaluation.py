@@ -54,10 +54,12 @@ def _run_single_iteration():
 
     df['Labeled Deletion'] = _apply_labeling(df, duplicates, age_threshold, size_threshold)
 
+    # The labels come from the same rules the rule engine applies, so it is turned off to score the model alone
     df = suggest_deletions.suggest_deletions(df=df,
                                              age_threshold_days=age_threshold,
                                              size_threshold_kb=(size_threshold // 1024),
-                                             stream_callback=print)
+                                             stream_callback=print,
+                                             use_rules=False)
 
     return df['Labeled Deletion'], df['LLM-Delete']
 
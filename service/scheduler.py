@@ -0,0 +1,122 @@
+import asyncio
+import collections
+import contextlib
+
+HIGH = 0
+NORMAL = 1
+LOW = 2
+PRIORITIES = {'high': HIGH, 'normal': NORMAL, 'low': LOW}
+
+MAX_ACTIVE = 2
+MAX_ACTIVE_PER_CLIENT = 1
+MAX_QUEUED_PER_CLIENT = 32
+
+
+class QueueFullError(Exception):
+    pass
+
+
+# Hands out slots for LLM operations across clients. The highest priority level with a waiting client goes first,
+# and within a level clients take turns, so one client submitting a hundred requests doesn't push everyone else's
+# single request to the back. A client never holds more than max_active_per_client slots; its other requests wait
+# (up to max_queued_per_client of them) and the slot goes to the next client in line. client_limits overrides the
+# per-client limit, e.g. for the service's own keyword batches. All methods run on the service's event loop, so no
+# locking is needed.
+class FairShareScheduler:
+    def __init__(self, max_active: int = MAX_ACTIVE, max_active_per_client: int = MAX_ACTIVE_PER_CLIENT,
+                 max_queued_per_client: int = MAX_QUEUED_PER_CLIENT):
+        self.max_active = max_active
+        self.max_active_per_client = max_active_per_client
+        self.max_queued_per_client = max_queued_per_client
+        self.client_limits = {}
+
+        # priority -> client -> waiting futures; the order of clients is the order of their turns
+        self._queues = {priority: collections.OrderedDict() for priority in PRIORITIES.values()}
+        self._queued_by_client = collections.Counter()
+        self._active_by_client = collections.Counter()
+        self._active = 0
+        self._granted = collections.Counter()
+        self._rejected = collections.Counter()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, client: str, priority: int = NORMAL):
+        if self._queued_by_client[client] >= self.max_queued_per_client:
+            self._rejected[client] += 1
+            raise QueueFullError(f'{client} already has {self._queued_by_client[client]} requests waiting')
+
+        future = asyncio.get_running_loop().create_future()
+        self._queues[priority].setdefault(client, collections.deque()).append(future)
+        self._queued_by_client[client] += 1
+        self._dispatch()
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            # A slot granted just as the request was cancelled has to be handed on
+            if future.done() and not future.cancelled():
+                self._release(client)
+            else:
+                self._remove(client, priority, future)
+            raise
+
+        try:
+            yield
+        finally:
+            self._release(client)
+
+    def get_stats(self) -> dict:
+        return {
+            'active': self._active,
+            'queued': sum(self._queued_by_client.values()),
+            'clients': {client: {'active': self._active_by_client[client],
+                                 'queued': self._queued_by_client[client],
+                                 'granted': self._granted[client],
+                                 'rejected': self._rejected[client]}
+                        for client in self._granted | self._queued_by_client | self._rejected},
+        }
+
+    def _dispatch(self):
+        while self._active < self.max_active:
+            next_waiter = self._pop_next()
+            if next_waiter is None:
+                return
+
+            client, future = next_waiter
+            self._active += 1
+            self._active_by_client[client] += 1
+            self._granted[client] += 1
+            future.set_result(None)
+
+    def _pop_next(self):
+        for priority in sorted(self._queues):
+            clients = self._queues[priority]
+            for client in list(clients):
+                if self._active_by_client[client] >= self.client_limits.get(client, self.max_active_per_client):
+                    continue
+
+                # The client goes to the back of the line for its next request
+                waiters = clients.pop(client)
+                future = waiters.popleft()
+                if waiters:
+                    clients[client] = waiters
+                self._queued_by_client[client] -= 1
+
+                # Cancelling a request cancels its future before slot() gets to remove it
+                if not future.cancelled():
+                    return client, future
+                return self._pop_next()
+
+        return None
+
+    def _release(self, client):
+        self._active -= 1
+        self._active_by_client[client] -= 1
+        self._dispatch()
+
+    def _remove(self, client, priority, future):
+        waiters = self._queues[priority].get(client)
+        if waiters and future in waiters:
+            waiters.remove(future)
+            self._queued_by_client[client] -= 1
+            if not waiters:
+                del self._queues[priority][client]
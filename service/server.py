@@ -0,0 +1,415 @@
+import argparse
+import asyncio
+import collections
+import http.server
+import json
+import os
+import threading
+
+import pandas as pd
+
+import core.cache
+from core import categorize, keywords, llm_interaction, metadata, search, suggest_deletions
+from service import scheduler
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+BATCH_WAIT_SECONDS = 0.05
+KEYWORDS_CLIENT = 'keyword-batches'
+REQUEST_TIMEOUT = 15 * 60
+MAX_BODY_BYTES = 64 * 1024 * 1024
+
+
+class PathNotAllowedError(Exception):
+    pass
+
+
+# Collects keyword requests from all clients into shared batch prompts. A batch is sent once it is full
+# (keywords.BATCH_TOKEN_BUDGET) or BATCH_WAIT_SECONDS after its first file came in, so a lone request is barely
+# delayed while a busy service sends a few large prompts instead of many small ones. At most max_batches are in
+# flight; while they are, files keep queueing up, so batches grow with the load. Batches take scheduler slots as
+# their own client, at the highest priority of the files in them. Files the service can read are looked
+# up in and added to the keywords cache; files sent with their content are prompted as they are.
+class KeywordBatcher:
+    def __init__(self, fair_scheduler: scheduler.FairShareScheduler,
+                 max_batches: int = scheduler.MAX_ACTIVE, batch_token_budget: int = keywords.BATCH_TOKEN_BUDGET,
+                 max_wait: float = BATCH_WAIT_SECONDS, timeout: float | None = None):
+        self.scheduler = fair_scheduler
+        self.max_batches = max_batches
+        self.batch_token_budget = batch_token_budget
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self.stats = collections.Counter(dict.fromkeys(['files', 'cached', 'batches', 'batched_files'], 0))
+
+        self._cache = core.cache.FileCache(keywords.KEYWORDS_CACHE_NAME)
+        self._queue = None
+        self._batch_slots = None
+        self._pending = {}
+        self._tasks = set()
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._batch_slots = asyncio.Semaphore(max(1, self.max_batches))
+        self._tasks.add(asyncio.create_task(self._run()))
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._cache.close()
+
+    async def get_keywords(self, files: list[dict], priority: int = scheduler.NORMAL) -> dict:
+        futures = await asyncio.gather(*[self._submit(file['path'], file.get('content'), priority) for file in files])
+        return {file['path']: await future for file, future in zip(files, futures)}
+
+    # Identical files requested by several clients at once share one prompt
+    async def _submit(self, path, content, priority):
+        key = (path, content)
+        if key in self._pending:
+            return self._pending[key]
+
+        self.stats['files'] += 1
+        future = asyncio.get_running_loop().create_future()
+
+        # Registered before the lookup gives up the event loop, so requests for the same file meanwhile share it
+        self._pending[key] = future
+        future.add_done_callback(lambda _: self._pending.pop(key, None))
+
+        if content is None:
+            try:
+                result = await self._lookup(path)
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            if not isinstance(result, keywords._FileContent):
+                self.stats['cached'] += 1
+                future.set_result(result)
+                return future
+            file_content = result
+        else:
+            file_content = keywords._FileContent(str(content)[:keywords.MAX_CONTENT_LENGTH], None, None, None)
+
+        self._queue.put_nowait((path, file_content, priority, future))
+        return future
+
+    # Stats the file, reads the cache and extracts the file's content off the event loop, like the keyword pipeline
+    async def _lookup(self, path):
+        try:
+            result, stat = await asyncio.to_thread(keywords._lookup_keywords, path, self._cache)
+            if result is None:
+                result = await asyncio.wait_for(asyncio.to_thread(
+                    keywords._extract_for_keywords, path, stat.st_size, stat.st_mtime),
+                    keywords.EXTRACT_TIMEOUT_SECONDS)
+        except Exception:
+            return 'Unknown'
+
+        return result
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        carried_item = None
+
+        while True:
+            await self._batch_slots.acquire()
+            batch = [carried_item or await self._queue.get()]
+            carried_item = None
+            deadline = loop.time() + self.max_wait
+
+            while (remaining := deadline - loop.time()) > 0:
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+
+                if not keywords._fits_in_batch([batch_item[:2] for batch_item in batch], *item[:2],
+                                               self.batch_token_budget):
+                    carried_item = item
+                    break
+                batch.append(item)
+
+            task = asyncio.create_task(self._prompt_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _prompt_batch(self, batch):
+        self.stats['batches'] += 1
+        self.stats['batched_files'] += len(batch)
+
+        try:
+            async with self.scheduler.slot(KEYWORDS_CLIENT, min(priority for _, _, priority, _ in batch)):
+                results = await keywords._prompt_keywords_batch([item[:2] for item in batch], timeout=self.timeout)
+        except Exception:
+            results = {}
+        finally:
+            self._batch_slots.release()
+
+        answered = [(path, file_content, results[path]) for path, file_content, _, _ in batch
+                    if file_content.size is not None and results.get(path, 'Unknown') != 'Unknown']
+        await asyncio.to_thread(keywords._put_batch_keywords, self._cache, answered)
+
+        for path, _, _, future in batch:
+            if not future.done():
+                future.set_result(results.get(path, 'Unknown'))
+
+
+# A local HTTP front for the LLM stages, so many users and workstations can share one Ollama server. Requests from
+# all clients go through one FairShareScheduler, and every LLM call through llm_interaction's model scheduler and
+# response cache, so requests for the loaded model run together instead of making the server swap models.
+# Handler threads parse requests and wait; the work itself runs on one event loop. Clients name themselves with an
+# X-Client-Id header (the client address otherwise) and can pass X-Priority: high, normal or low.
+#
+# POST /keywords           {"files": [{"path": ..., "content": optional}]}
+# POST /categorize         {"files": [metadata rows] or "folder": path, "categories": [...], "use_keywords": true}
+# POST /search             {"files" or "folder", "query": ..., "max_results": 10}
+# POST /suggest_deletions  {"files" or "folder", "max_age_days": 30, "max_size_kb": 1024}
+# GET  /stats
+#
+# Metadata rows are core.metadata.get_files_metadata() rows; paths must be readable by the service for keywords
+# and duplicate detection. The service has no authentication, so it only reads folders and files under
+# allowed_roots (none by default) and answers 403 for anything else; files sent with their content or keywords
+# are never read.
+class LLMService:
+    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, max_active: int = scheduler.MAX_ACTIVE,
+                 max_active_per_client: int = scheduler.MAX_ACTIVE_PER_CLIENT,
+                 max_queued_per_client: int = scheduler.MAX_QUEUED_PER_CLIENT, timeout: float | None = None,
+                 allowed_roots: list[str] | None = None):
+        self.timeout = timeout
+        self.allowed_roots = [os.path.realpath(root) for root in allowed_roots or []]
+        self.scheduler = scheduler.FairShareScheduler(max_active, max_active_per_client, max_queued_per_client)
+        self.scheduler.client_limits[KEYWORDS_CLIENT] = max_active
+        self.batcher = KeywordBatcher(self.scheduler, max_active, timeout=timeout)
+        self.routes = {
+            '/keywords': self._keywords,
+            '/categorize': self._categorize,
+            '/search': self._search,
+            '/suggest_deletions': self._suggest_deletions,
+        }
+
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._server = http.server.ThreadingHTTPServer((host, port), _make_handler(self))
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._loop_thread.start()
+        asyncio.run_coroutine_threadsafe(self._start_batcher(), self._loop).result()
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        asyncio.run_coroutine_threadsafe(self._stop_batcher(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop_thread.join()
+        self._loop.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *_):
+        self.stop()
+
+    def call(self, route: str, client: str, priority: int, body: dict) -> dict:
+        future = asyncio.run_coroutine_threadsafe(self.routes[route](client, priority, body), self._loop)
+        try:
+            return future.result(REQUEST_TIMEOUT)
+        except TimeoutError:
+            future.cancel()
+            raise
+
+    def get_stats(self) -> dict:
+        return asyncio.run_coroutine_threadsafe(self._get_stats(), self._loop).result()
+
+    async def _start_batcher(self):
+        self.batcher.start()
+
+    async def _stop_batcher(self):
+        self.batcher.stop()
+        await asyncio.sleep(0)
+
+    async def _get_stats(self) -> dict:
+        return {'scheduler': self.scheduler.get_stats(), 'keywords': dict(self.batcher.stats)}
+
+    async def _keywords(self, client, priority, body):
+        await asyncio.to_thread(self._check_paths, [file['path'] for file in body['files']
+                                                    if file.get('content') is None])
+        return {'keywords': await self.batcher.get_keywords(body['files'], priority)}
+
+    # Keywords go through the batcher before the request takes its slot, so a categorize request never holds a
+    # slot while it waits for keyword batches that need one too
+    async def _categorize(self, client, priority, body):
+        df = await self._get_df(body)
+        if df.empty:
+            return {'categories': {}}
+
+        use_keywords = body.get('use_keywords', True)
+        if use_keywords:
+            await self._fill_keywords(df, priority)
+
+        async with self.scheduler.slot(client, priority):
+            df = await categorize.categorize_async(df, use_keywords, body.get('categories'), timeout=self.timeout)
+
+        return {'categories': dict(zip(df['Path'], df['LLM-Categorized']))}
+
+    async def _search(self, client, priority, body):
+        df = await self._get_df(body)
+        if df.empty:
+            return {'results': []}
+
+        if 'LLM-Categorized' not in df.columns:
+            await self._fill_keywords(df, priority)
+
+        async with self.scheduler.slot(client, priority):
+            results = await search.search_async(df, body['query'], int(body.get('max_results', 10)),
+                                                timeout=self.timeout)
+
+        return {'results': results}
+
+    async def _suggest_deletions(self, client, priority, body):
+        df = await self._get_df(body)
+        if df.empty:
+            return {'deletions': {}}
+
+        # Duplicates are found by hashing the files
+        if 'folder' not in body:
+            await asyncio.to_thread(self._check_paths, df['Path'])
+
+        async with self.scheduler.slot(client, priority):
+            df = await suggest_deletions.suggest_deletions_async(df, int(body.get('max_age_days', 30)),
+                                                                 int(body.get('max_size_kb', 1024)),
+                                                                 timeout=self.timeout)
+
+        deletions_df = df[df['LLM-Delete'] == 'Delete']
+        return {'deletions': dict(zip(deletions_df['Path'], deletions_df['LLM-Delete-Reason']))}
+
+    async def _fill_keywords(self, df, priority):
+        missing = df['Keywords'].isna() if 'Keywords' in df.columns else pd.Series(True, index=df.index)
+        await asyncio.to_thread(self._check_paths, df.loc[missing, 'Path'])
+        results = await self.batcher.get_keywords([{'path': path} for path in df.loc[missing, 'Path']], priority)
+        df.loc[missing, 'Keywords'] = df.loc[missing, 'Path'].map(results)
+
+    async def _get_df(self, body):
+        if 'folder' in body:
+            folder = body['folder']
+            self._check_paths([folder])
+            if not os.path.isdir(folder):
+                raise ValueError(f'Not a folder: {folder}')
+            return await asyncio.to_thread(metadata.get_files_metadata, folder)
+
+        if not body['files']:
+            return pd.DataFrame(columns=metadata.SCAN_COLUMNS)
+
+        df = pd.DataFrame(body['files'])
+        if not {'Path', 'Filename'}.issubset(df.columns):
+            raise ValueError('Each file needs at least a Path and a Filename')
+        return df
+
+    # Symlinks are resolved first, so a link inside an allowed root can't point the service elsewhere. That is a few
+    # syscalls per path, so the checks for whole file lists run off the event loop
+    def _check_paths(self, paths):
+        for path in paths:
+            real_path = os.path.realpath(path)
+            if not any(_is_within(real_path, root) for root in self.allowed_roots):
+                raise PathNotAllowedError(f'{path} is not in a folder the service may read')
+
+
+def _is_within(path, root):
+    try:
+        return os.path.commonpath([path, root]) == root
+    except ValueError:
+        # Paths on different Windows drives
+        return False
+
+
+def _make_handler(service: LLMService):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            if self.path == '/stats':
+                self._send_json(service.get_stats())
+            else:
+                self._send_json({'error': 'not found'}, 404)
+
+        def do_POST(self):
+            content_length = int(self.headers.get('Content-Length', 0))
+            if content_length > MAX_BODY_BYTES:
+                self._send_json({'error': 'request too large'}, 413)
+                self.close_connection = True
+                return
+
+            # The body is read before anything is rejected, so the connection can be reused
+            request_body = self.rfile.read(content_length)
+            if self.path not in service.routes:
+                self._send_json({'error': 'not found'}, 404)
+                return
+
+            client = self.headers.get('X-Client-Id') or self.client_address[0]
+            priority = scheduler.PRIORITIES.get(self.headers.get('X-Priority', 'normal').lower())
+            if priority is None:
+                self._send_json({'error': f'X-Priority must be one of {", ".join(scheduler.PRIORITIES)}'}, 400)
+                return
+
+            try:
+                body = json.loads(request_body or b'{}')
+                self._send_json(service.call(self.path, client, priority, body))
+            except scheduler.QueueFullError as e:
+                self._send_json({'error': str(e)}, 429)
+            except PathNotAllowedError as e:
+                self._send_json({'error': str(e)}, 403)
+            except (KeyError, TypeError, ValueError) as e:
+                self._send_json({'error': f'bad request: {type(e).__name__}: {e}'}, 400)
+            except TimeoutError:
+                self._send_json({'error': 'request timed out'}, 504)
+            except Exception as e:
+                self._send_json({'error': f'{type(e).__name__}: {e}'}, 500)
+
+        def _send_json(self, data: dict, status: int = 200):
+            payload = json.dumps(data, default=str).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *_):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve categorize, search and deletion suggestions over HTTP to '
+                                                 'several clients sharing one Ollama server.')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--max-active', type=int, default=llm_interaction.scheduler.max_parallel,
+                        help='Requests running at once across all clients')
+    parser.add_argument('--max-active-per-client', type=int, default=scheduler.MAX_ACTIVE_PER_CLIENT)
+    parser.add_argument('--max-queued-per-client', type=int, default=scheduler.MAX_QUEUED_PER_CLIENT)
+    parser.add_argument('--timeout', type=float, help='Timeout in seconds for each LLM request')
+    parser.add_argument('--allow-root', action='append', default=[], dest='allowed_roots', metavar='FOLDER',
+                        help='Folder whose files clients may have the service read; can be repeated')
+    args = parser.parse_args()
+
+    service = LLMService(args.host, args.port, args.max_active, args.max_active_per_client,
+                         args.max_queued_per_client, args.timeout, args.allowed_roots)
+
+    print(f'LLM service listening on {service.url}, '
+          f'using Ollama at {llm_interaction.OLLAMA_HOST or "the default host"}')
+    with service:
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,33 +1,532 @@
+import concurrent.futures
+import contextlib
+import datetime
+import errno
+import glob
+import json
 import os
 import shutil
+import sqlite3
+import threading
+import time
+import typing
+import uuid
 
+import pandas as pd
 from send2trash import send2trash
 
+import core.cache
+import core.metadata
+
 DOWNLOADS_FOLDER = os.path.expanduser("~/Downloads")
+COPY_WORKERS = min(8, os.cpu_count() or 1)
+JOURNAL_PREFIX = 'moves_'
+JOURNAL_FLUSH_INTERVAL = 256
+PARTIAL_SUFFIX = '.partial'
+QUARANTINE_NAME = 'quarantine'
+QUARANTINE_RETENTION_DAYS = 30
+PURGE_INTERVAL_SECONDS = 60 * 60
+SQLITE_MAX_VARIABLES = 900
+
+_quarantine = None
+_quarantine_lock = threading.Lock()
+
+
+class MoveOperation(typing.NamedTuple):
+    source: str
+    target: str
+    same_device: bool
+
+
+class MovePlan(typing.NamedTuple):
+    operations: list[MoveOperation]
+    new_folders: list[str]
+    renamed: dict[str, str]
+    skipped: dict[str, str]
+
+
+class MoveResult(typing.NamedTuple):
+    plan: MovePlan
+    moved: list[tuple[str, str]]
+    failed: dict[str, str]
+    journal_path: str | None
+
+
+def move_to_category_folders(df, destination_folder: str | None = None, dry_run: bool = False,
+                             max_workers: int = COPY_WORKERS) -> MoveResult:
+    plan = plan_moves(df, destination_folder)
+    return execute_moves(plan, destination_folder, dry_run=dry_run, max_workers=max_workers)
+
+
+# Works out every target up front: one directory listing per category folder instead of an exists() call per
+# file, and name collisions (with files on disk or with other files in the plan) get a Windows-style " (n)"
+# suffix. Same-device moves are plain renames, everything else has to be copied.
+def plan_moves(df, destination_folder: str | None = None) -> MovePlan:
+    destination_folder = destination_folder or DOWNLOADS_FOLDER
+    destination_device = os.stat(destination_folder).st_dev
+
+    taken_names = {}
+    source_devices = {}
+    operations = []
+    new_folders = []
+    renamed = {}
+    skipped = {}
+
+    for source, category in zip(df['Path'], df['LLM-Categorized']):
+        if not isinstance(category, str) or not category.strip():
+            skipped[source] = 'No category'
+            continue
+
+        category_path = os.path.join(destination_folder, category)
+        if os.path.dirname(os.path.abspath(source)) == os.path.abspath(category_path):
+            skipped[source] = 'Already in its category folder'
+            continue
+
+        source_folder = os.path.dirname(source)
+        if source_folder not in source_devices:
+            try:
+                source_devices[source_folder] = os.stat(source_folder).st_dev
+            except OSError:
+                source_devices[source_folder] = None
+        if source_devices[source_folder] is None:
+            skipped[source] = 'Source folder not found'
+            continue
+
+        if category_path not in taken_names:
+            taken_names[category_path] = _list_names(category_path)
+            if taken_names[category_path] is None:
+                taken_names[category_path] = set()
+                new_folders.append(category_path)
+
+        filename = _get_free_name(os.path.basename(source), taken_names[category_path])
+        taken_names[category_path].add(filename)
+        target = os.path.join(category_path, filename)
+        if filename != os.path.basename(source):
+            renamed[source] = target
+
+        operations.append(MoveOperation(source, target, source_devices[source_folder] == destination_device))
+
+    return MovePlan(operations, new_folders, renamed, skipped)
+
+
+def execute_moves(plan: MovePlan, destination_folder: str | None = None, dry_run: bool = False,
+                  max_workers: int = COPY_WORKERS, journal_path: str | None = None) -> MoveResult:
+    if dry_run:
+        return MoveResult(plan, [(operation.source, operation.target) for operation in plan.operations], {}, None)
+
+    journal_path = journal_path or _new_journal_path()
+    with open(journal_path, 'w', encoding='utf-8') as journal:
+        journal.write(json.dumps({'destination': destination_folder or DOWNLOADS_FOLDER,
+                                  'new_folders': plan.new_folders}) + '\n')
+        for operation in plan.operations:
+            journal.write(json.dumps(operation._asdict()) + '\n')
+
+    return _run_journal(journal_path, max_workers)._replace(plan=plan)
+
+
+# Picks up an interrupted run where it stopped. Moves that finished but weren't journaled yet are recognized by
+# their source being gone and their target being in place.
+def resume_moves(journal_path: str | None = None, max_workers: int = COPY_WORKERS) -> MoveResult:
+    journal_path = journal_path or get_last_journal()
+    return _run_journal(journal_path, max_workers)
+
 
+def undo_moves(journal_path: str | None = None, max_workers: int = COPY_WORKERS) -> MoveResult:
+    journal_path = journal_path or get_last_journal()
+    header, operations, done, undone = _read_journal(journal_path)
 
-def move_to_category_folders(df):
-    for category in df['LLM-Categorized'].unique():
-        category_path = os.path.join(DOWNLOADS_FOLDER, category)
-        if not os.path.exists(category_path):
-            os.makedirs(category_path)
+    # Moves whose record was lost (e.g. the run was interrupted) are recognized by where the file is now
+    pending = [(i, MoveOperation(operation.target, operation.source, operation.same_device))
+               for i, operation in reversed(list(enumerate(operations)))
+               if i not in undone and (i in done or _was_moved(operation))]
 
-    def move_file(row):
-        file_path = row['Path']
-        file_category = row['LLM-Categorized']
-        category_path = os.path.join(DOWNLOADS_FOLDER, file_category)
-        new_path = os.path.join(category_path, os.path.basename(file_path))
+    moved, failed = _apply_operations(journal_path, pending, 'undone', max_workers)
+
+    # Category folders the move created are removed again once they are empty
+    for folder in header.get('new_folders', []):
         try:
-            shutil.move(file_path, new_path)
-        except Exception as e:
-            print(f'Failed to move {file_path} to {new_path}: {e}')
+            os.rmdir(folder)
+        except OSError:
+            pass
+
+    plan = MovePlan([operation for _, operation in pending], [], {}, {})
+    return MoveResult(plan, moved, failed, journal_path)
+
+
+def get_journals() -> list[str]:
+    return sorted(glob.glob(core.cache.get_cache_path(f'{JOURNAL_PREFIX}*.jsonl')), reverse=True)
 
-    df.apply(move_file, axis=1)
 
+def get_last_journal() -> str | None:
+    journals = get_journals()
+    return journals[0] if journals else None
+
+
+def delete_suggested_files(paths: list[str], quarantine: bool = False):
+    if quarantine:
+        _, failed = get_quarantine().quarantine(paths)
+        for path, error in failed.items():
+            print(f'Failed to delete {path}: {error}')
+        return
 
-def delete_suggested_files(paths: list[str]):
     for path in paths:
         try:
             send2trash(path)
         except OSError as e:
             print(f'Failed to delete {path}: {e}')
+
+
+def get_quarantine() -> 'QuarantineStore':
+    global _quarantine
+
+    with _quarantine_lock:
+        if _quarantine is None:
+            _quarantine = QuarantineStore()
+            _quarantine.start_background_purge()
+        return _quarantine
+
+
+# Deleted files are renamed into a staging folder on the same filesystem and recorded in an SQLite index, so a
+# large cleanup returns right away and can be restored until the retention period is over. The staging folder
+# lives in the cache folder when that is on the same device, and next to the file otherwise. Files are only
+# really deleted by purge(), which start_background_purge() runs periodically.
+class QuarantineStore:
+    def __init__(self, retention_days: float = QUARANTINE_RETENTION_DAYS, db_path: str | None = None):
+        self.retention_days = retention_days
+        self.db_path = db_path or core.cache.get_cache_path(f'{QUARANTINE_NAME}.sqlite3')
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS items ('
+                           'id INTEGER PRIMARY KEY AUTOINCREMENT, original_path TEXT, quarantine_path TEXT, '
+                           'size INTEGER, quarantined_at REAL, purge_after REAL, pending INTEGER NOT NULL DEFAULT 0)')
+        # Databases created before items were recorded ahead of their rename have no pending column
+        with contextlib.suppress(sqlite3.OperationalError):
+            self._conn.execute('ALTER TABLE items ADD COLUMN pending INTEGER NOT NULL DEFAULT 0')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS items_purge_after ON items (purge_after)')
+        self._conn.commit()
+
+        self._default_folder = os.path.join(os.path.dirname(self.db_path), QUARANTINE_NAME)
+        self._folders_by_device = {}
+        self._stop_purge = threading.Event()
+
+        self._recover_pending()
+
+    # Every item is recorded as pending before its file is renamed and confirmed afterwards, so an interruption
+    # never leaves a staged file the index doesn't know about. Both steps are one transaction for all paths.
+    def quarantine(self, paths: list[str]) -> tuple[dict[str, str], dict[str, str]]:
+        now = time.time()
+        quarantined = {}
+        failed = {}
+        rows = []
+
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                quarantine_path = os.path.join(self._get_folder(stat.st_dev, path),
+                                               f'{uuid.uuid4().hex}_{os.path.basename(path)}')
+            except OSError as e:
+                failed[path] = str(e)
+                continue
+
+            rows.append((path, quarantine_path, stat.st_size, now, now + self.retention_days * 86400))
+
+        with self._lock:
+            ids = [self._conn.execute('INSERT INTO items (original_path, quarantine_path, size, quarantined_at, '
+                                      'purge_after, pending) VALUES (?, ?, ?, ?, ?, 1)', row).lastrowid
+                   for row in rows]
+            self._conn.commit()
+
+        staged_ids = []
+        failed_ids = []
+        for item_id, (path, quarantine_path, *_) in zip(ids, rows):
+            try:
+                os.rename(path, quarantine_path)
+            except OSError as e:
+                failed[path] = str(e)
+                failed_ids.append((item_id,))
+                continue
+
+            quarantined[path] = quarantine_path
+            staged_ids.append((item_id,))
+
+        with self._lock:
+            self._conn.executemany('UPDATE items SET pending = 0 WHERE id = ?', staged_ids)
+            self._conn.executemany('DELETE FROM items WHERE id = ?', failed_ids)
+            self._conn.commit()
+
+        return quarantined, failed
+
+    def get_items(self) -> pd.DataFrame:
+        with self._lock:
+            rows = self._conn.execute('SELECT id, original_path, size, quarantined_at, purge_after FROM items '
+                                      'WHERE NOT pending ORDER BY quarantined_at DESC, id DESC').fetchall()
+
+        df = pd.DataFrame(rows, columns=['Id', 'Original Path', 'Size (Raw)', 'Quarantined (Raw)',
+                                         'Purge After (Raw)'])
+        df.insert(2, 'Filename', df['Original Path'].map(os.path.basename))
+        df['Quarantined'] = pd.to_datetime(df['Quarantined (Raw)'], unit='s').dt.strftime('%Y-%m-%d %H:%M')
+        df['Purge After'] = pd.to_datetime(df['Purge After (Raw)'], unit='s').dt.strftime('%Y-%m-%d %H:%M')
+
+        return df
+
+    # Files go back to where they came from, with a " (n)" suffix if something else has taken the name since
+    def restore(self, ids: list[int] | None = None) -> tuple[dict[str, str], dict[str, str]]:
+        rows = self._select(ids)
+        restored = {}
+        failed = {}
+        restored_ids = []
+        taken_names = {}
+
+        for item_id, original_path, quarantine_path in rows:
+            folder_path = os.path.dirname(original_path)
+            try:
+                if folder_path not in taken_names:
+                    os.makedirs(folder_path, exist_ok=True)
+                    taken_names[folder_path] = _list_names(folder_path) or set()
+
+                filename = _get_free_name(os.path.basename(original_path), taken_names[folder_path])
+                os.rename(quarantine_path, os.path.join(folder_path, filename))
+            except OSError as e:
+                failed[original_path] = str(e)
+                continue
+
+            taken_names[folder_path].add(filename)
+            restored[original_path] = os.path.join(folder_path, filename)
+            restored_ids.append((item_id,))
+
+        self._delete_rows(restored_ids)
+        return restored, failed
+
+    def purge(self, purge_all: bool = False) -> int:
+        with self._lock:
+            query = 'SELECT id, quarantine_path FROM items WHERE NOT pending'
+            rows = self._conn.execute(query if purge_all else f'{query} AND purge_after <= ?',
+                                      () if purge_all else (time.time(),)).fetchall()
+
+        purged_ids = []
+        for item_id, quarantine_path in rows:
+            try:
+                os.remove(quarantine_path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f'Failed to purge {quarantine_path}: {e}')
+                continue
+            purged_ids.append((item_id,))
+
+        self._delete_rows(purged_ids)
+        return len(purged_ids)
+
+    def start_background_purge(self, interval_seconds: float = PURGE_INTERVAL_SECONDS):
+        def purge_periodically():
+            while not self._stop_purge.is_set():
+                try:
+                    self.purge()
+                except Exception as e:
+                    print(f'Failed to purge quarantine: {e}')
+                self._stop_purge.wait(interval_seconds)
+
+        threading.Thread(target=purge_periodically, daemon=True).start()
+
+    def close(self):
+        self._stop_purge.set()
+        with self._lock:
+            self._conn.close()
+
+    def _select(self, ids):
+        with self._lock:
+            if ids is None:
+                return self._conn.execute('SELECT id, original_path, quarantine_path FROM items '
+                                          'WHERE NOT pending').fetchall()
+
+            rows = []
+            for i in range(0, len(ids), SQLITE_MAX_VARIABLES):
+                batch = list(ids[i:i + SQLITE_MAX_VARIABLES])
+                rows += self._conn.execute('SELECT id, original_path, quarantine_path FROM items WHERE NOT pending '
+                                           f'AND id IN ({",".join("?" * len(batch))})', batch).fetchall()
+            return rows
+
+    def _delete_rows(self, ids):
+        if ids:
+            with self._lock:
+                self._conn.executemany('DELETE FROM items WHERE id = ?', ids)
+                self._conn.commit()
+
+    # Items left pending by an interrupted quarantine() were staged if their file made it to the staging folder
+    def _recover_pending(self):
+        with self._lock:
+            rows = self._conn.execute('SELECT id, quarantine_path FROM items WHERE pending').fetchall()
+
+            staged = [(item_id,) for item_id, quarantine_path in rows if os.path.lexists(quarantine_path)]
+            self._conn.executemany('UPDATE items SET pending = 0 WHERE id = ?', staged)
+            self._conn.executemany('DELETE FROM items WHERE id = ? AND pending',
+                                   [(item_id,) for item_id, _ in rows])
+            self._conn.commit()
+
+    def _get_folder(self, device, path):
+        if device not in self._folders_by_device:
+            os.makedirs(self._default_folder, exist_ok=True)
+            if os.stat(self._default_folder).st_dev == device:
+                self._folders_by_device[device] = self._default_folder
+            else:
+                # A rename can't cross filesystems, so files elsewhere are staged next to where they are
+                self._folders_by_device[device] = None
+
+        folder_path = self._folders_by_device[device]
+        if folder_path is None:
+            folder_path = os.path.join(os.path.dirname(os.path.abspath(path)), core.metadata.QUARANTINE_FOLDER_NAME)
+            os.makedirs(folder_path, exist_ok=True)
+
+        return folder_path
+
+
+def _run_journal(journal_path, max_workers) -> MoveResult:
+    header, operations, done, _ = _read_journal(journal_path)
+
+    for folder in header.get('new_folders', []):
+        os.makedirs(folder, exist_ok=True)
+
+    pending = [(i, operation) for i, operation in enumerate(operations) if i not in done]
+    moved, failed = _apply_operations(journal_path, pending, 'done', max_workers)
+
+    plan = MovePlan(operations, header.get('new_folders', []), {}, {})
+    return MoveResult(plan, moved, failed, journal_path)
+
+
+# Renames are metadata-only and run one after the other; cross-device copies run in a thread pool. Completed
+# operations are appended to the journal in batches rather than synced one by one, since a move that finished
+# without its record is recognized on resume anyway.
+def _apply_operations(journal_path, indexed_operations, record_type, max_workers):
+    moved = []
+    failed = {}
+
+    with open(journal_path, 'a+', encoding='utf-8') as journal:
+        # A record cut off by an interruption is ended first so it doesn't swallow the next one
+        if journal.tell() > 0:
+            journal.seek(journal.tell() - 1)
+            if journal.read(1) != '\n':
+                journal.write('\n')
+
+        def record(i, operation, error):
+            if error is None:
+                moved.append((operation.source, operation.target))
+                journal.write(json.dumps({record_type: i}) + '\n')
+                if len(moved) % JOURNAL_FLUSH_INTERVAL == 0:
+                    journal.flush()
+            else:
+                failed[operation.source] = error
+
+        copies = []
+        for i, operation in indexed_operations:
+            if operation.same_device:
+                record(i, operation, _move_file(operation))
+            else:
+                copies.append((i, operation))
+
+        if copies:
+            with concurrent.futures.ThreadPoolExecutor(max_workers) as pool:
+                futures = {pool.submit(_move_file, operation): (i, operation) for i, operation in copies}
+                for future in concurrent.futures.as_completed(futures):
+                    record(*futures[future], future.result())
+
+    return moved, failed
+
+
+def _move_file(operation: MoveOperation) -> str | None:
+    source, target = operation.source, operation.target
+
+    try:
+        if not os.path.lexists(source):
+            if os.path.lexists(target):
+                return None
+            return 'Source file not found'
+
+        if os.path.lexists(target):
+            # An interrupted copy can leave both behind; copy2 keeps size and mtime, which tells the finished copy
+            # apart from an unrelated file that took the name in the meantime
+            if operation.same_device or not _is_same_file_copy(source, target):
+                return f'Target already exists: {target}'
+            os.remove(source)
+            return None
+
+        if operation.same_device:
+            try:
+                os.rename(source, target)
+                return None
+            except OSError as e:
+                # A bind mount can put two folders of the same device on different mounts
+                if e.errno != errno.EXDEV:
+                    raise
+
+        # Copying to a temporary name first means a half-written target is never mistaken for a finished one
+        partial_path = target + PARTIAL_SUFFIX
+        try:
+            shutil.copy2(source, partial_path)
+            os.replace(partial_path, target)
+        except OSError:
+            if os.path.lexists(partial_path):
+                os.remove(partial_path)
+            raise
+        os.remove(source)
+        return None
+    except OSError as e:
+        return str(e)
+
+
+def _was_moved(operation: MoveOperation) -> bool:
+    return not os.path.lexists(operation.source) and os.path.lexists(operation.target)
+
+
+def _is_same_file_copy(source, target) -> bool:
+    source_stat, target_stat = os.stat(source), os.stat(target)
+    return source_stat.st_size == target_stat.st_size and source_stat.st_mtime == target_stat.st_mtime
+
+
+def _read_journal(journal_path):
+    operations = []
+    done = set()
+    undone = set()
+
+    with open(journal_path, encoding='utf-8') as journal:
+        header = json.loads(journal.readline())
+        for line in journal:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # The last line can be cut off if the run was interrupted while writing it
+                continue
+
+            if 'done' in entry:
+                done.add(entry['done'])
+            elif 'undone' in entry:
+                undone.add(entry['undone'])
+            else:
+                operations.append(MoveOperation(**entry))
+
+    return header, operations, done, undone
+
+
+def _new_journal_path() -> str:
+    timestamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    return core.cache.get_cache_path(f'{JOURNAL_PREFIX}{timestamp}.jsonl')
+
+
+def _list_names(folder_path) -> set | None:
+    try:
+        with os.scandir(folder_path) as entries:
+            return {entry.name for entry in entries}
+    except FileNotFoundError:
+        return None
+
+
+def _get_free_name(filename: str, taken_names: set) -> str:
+    if filename not in taken_names:
+        return filename
+
+    stem, extension = os.path.splitext(filename)
+    n = 1
+    while f'{stem} ({n}){extension}' in taken_names:
+        n += 1
+    return f'{stem} ({n}){extension}'
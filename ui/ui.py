@@ -1,45 +1,215 @@
 import os
 import sys
+import time
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from core import metadata, categorize, suggest_deletions, search
+from core import metadata, categorize, suggest_deletions, search, llm_interaction, watcher, jobs
 import streamlit as st
 import file_interaction
 
 # -- Constants --
 DOWNLOADS_PATH = os.path.expanduser("~\\Downloads")
+SIGNATURE_CHECK_SECONDS = 10
+TABLE_PAGE_SIZE = 500
+CHECKBOX_PAGE_SIZE = 50
+STREAM_FRAME_RATE = 4
+STREAM_THINKING_CHARS = 2000
+STREAM_RESPONSE_CHARS = 4000
+
+
+# Only the tail of the reasoning is rendered, and of the response too while it streams, so a frame costs the same
+# however long the generation gets. Folds fall on a line break where there is one nearby.
+def _show_llm_output(text: str, streaming: bool = False):
+    if not text:
+        return
+
+    thinking, end_of_thinking, response = text.partition("</think>")
+    thinking = thinking.replace("<think>", "", 1)
+
+    if thinking.strip():
+        folded, thinking = _fold(thinking, STREAM_THINKING_CHARS)
+        with st.expander("### Thinking...", expanded=not end_of_thinking):
+            if folded:
+                st.caption(f"{folded:,} earlier characters folded")
+            st.markdown(
+                f"<div style='color: gray; font-size: 0.9em;'>{thinking}</div>",
+                unsafe_allow_html=True
+            )
 
-
-def _stream_callback_factory():
-    if "last_thinking" not in st.session_state:
-        st.session_state.last_thinking = ""
-    if "last_response" not in st.session_state:
-        st.session_state.last_response = ""
-
-    think_box = st.empty()
-    response_box = st.empty()
-
-    def callback(text):
-        if "</think>" not in text:
-            clean_text = text.replace("<think>", "")
-            st.session_state.last_thinking = clean_text
-            with think_box.expander("### Thinking...", expanded=True):
-                st.markdown(
-                    f"<div style='color: gray; font-size: 0.9em;'>{clean_text}</div>",
-                    unsafe_allow_html=True
-                )
+    if end_of_thinking:
+        folded, response_tail = _fold(response, STREAM_RESPONSE_CHARS) if streaming else (0, response)
+        if folded:
+            # The tail of a response can start inside a code block, so it is shown verbatim
+            st.markdown("### Response")
+            st.caption(f"{folded:,} earlier characters folded")
+            st.code(response_tail, language=None)
         else:
-            response_text = text.split("</think>")[-1]
-            st.session_state.last_response = response_text
-            response_box.markdown("### Response\n" + response_text)
+            st.markdown("### Response\n" + response_tail)
+
+
+def _fold(text: str, max_chars: int) -> tuple[int, str]:
+    if len(text) <= max_chars:
+        return 0, text
+
+    cut = len(text) - max_chars
+    line_break = text.find("\n", cut, cut + max_chars // 10)
+    if line_break != -1:
+        cut = line_break + 1
+    return cut, text[cut:]
+
+
+@st.cache_resource(show_spinner=False)
+def _get_job_runner():
+    return jobs.JobRunner()
+
+
+# LLM operations run as background jobs, so the page stays usable and a rerun doesn't throw the work away. Each tab
+# remembers its last job; a new session picks up the latest job of each kind, finished or not.
+def _get_job(kind: str) -> jobs.JobInfo | None:
+    if "job_ids" not in st.session_state:
+        st.session_state.job_ids = {}
+        for job in _get_job_runner().get_jobs():
+            st.session_state.job_ids.setdefault(job.kind, job.id)
+
+    job_id = st.session_state.job_ids.get(kind)
+    return _get_job_runner().get(job_id, include_result=False) if job_id else None
+
+
+def _submit_job(kind: str, run, *args, **kwargs):
+    st.session_state.job_ids[kind] = _get_job_runner().submit(kind, run, *args, **kwargs)
+    st.rerun()
+
+
+# Returns the job's result the first time it is seen finished in this session, and None after that
+def _take_job_result(job: jobs.JobInfo | None):
+    if job is None or job.status != jobs.DONE or st.session_state.get(f"{job.kind}_result_job") == job.id:
+        return None
+
+    st.session_state[f"{job.kind}_result_job"] = job.id
+    return _get_job_runner().get(job.id).result
+
+
+def _show_job(job: jobs.JobInfo | None):
+    if job is None:
+        return
+
+    if job.status in jobs.ACTIVE_STATUSES:
+        _job_progress(job.id)
+        return
+
+    _show_llm_output(job.stream_text)
+    if job.status == jobs.FAILED:
+        st.error(f"Job failed: {job.error}")
+    elif job.status == jobs.CANCELLED:
+        st.warning("Job cancelled.")
+
+
+# Only this fragment reruns while a job is active, at most STREAM_FRAME_RATE times a second; the whole page reruns
+# once it finishes to show the results
+@st.fragment(run_every=1 / STREAM_FRAME_RATE)
+def _job_progress(job_id: str):
+    job = _get_job_runner().get(job_id, include_result=False)
+    if job is None or job.status in jobs.FINISHED_STATUSES:
+        st.rerun()
+
+    st.progress(job.progress, text=job.message or job.status.capitalize())
+    if st.button("Cancel", key=f"cancel_{job_id}"):
+        _get_job_runner().cancel(job_id)
+    _show_llm_output(job.stream_text, streaming=True)
+
+
+def _categorize_job(job, df, user_categories):
+    def keyword_progress_callback(i, total, stats=None):
+        cached = f" ({stats['hits']} cached)" if stats else ""
+        job.set_progress(i / total, f"Generating file keywords: {i}/{total}{cached}")
+
+    return categorize.categorize_async(df, user_categories=user_categories,
+                                       stream_callback=job.append_stream_text,
+                                       progress_callback=keyword_progress_callback)
+
+
+async def _suggest_deletions_job(job, df, max_age_days, max_size_kb):
+    job.set_progress(0, "Analyzing metadata...")
+    suggestions_df = await suggest_deletions.suggest_deletions_async(df, max_age_days, max_size_kb,
+                                                                     stream_callback=job.append_stream_text)
+    suggestions_df = suggestions_df[suggestions_df['LLM-Delete'] == 'Delete']
+    return dict(zip(suggestions_df['Filename'], suggestions_df['LLM-Delete-Reason']))
+
+
+async def _search_job(job, df, query, max_num_results):
+    job.set_progress(0, "Searching files...")
+    return query, await search.search_async(df, query, max_num_results, stream_callback=job.append_stream_text)
+
+
+# Streamlit reruns the script on every interaction, so the folder is only rescanned when it changed: the folder's
+# mtime catches added, removed and renamed files on every rerun, and the watcher (inotify, or an entry signature
+# checked every SIGNATURE_CHECK_SECONDS) catches files modified in place. Rescans go through the snapshot so
+# keywords and categories carry over to unchanged files.
+def _get_files_df(force_refresh: bool = False):
+    state = st.session_state
+    folder_watcher = _get_folder_watcher(DOWNLOADS_PATH)
+    if "folder_version" not in state:
+        state.folder_version = None
+        state.folder_mtime = None
+        state.last_signature_check = time.monotonic()
+
+    folder_mtime = os.stat(DOWNLOADS_PATH).st_mtime_ns
+    changed = force_refresh or "df" not in state or folder_mtime != state.folder_mtime
+
+    now = time.monotonic()
+    if not changed and (folder_watcher.uses_inotify or now - state.last_signature_check >= SIGNATURE_CHECK_SECONDS):
+        state.last_signature_check = now
+        changed = folder_watcher.get_version() != state.folder_version
+
+    if changed:
+        state.folder_version = folder_watcher.get_version()
+        state.folder_mtime = folder_mtime
+        _set_files_df(metadata.get_files_delta(DOWNLOADS_PATH).df)
+
+    return state.df
 
-    return callback
+
+# Sessions share one watcher per folder; Streamlit doesn't say when a session ends, so a watcher per session
+# would never be closed
+@st.cache_resource(show_spinner=False)
+def _get_folder_watcher(folder_path):
+    return watcher.FolderWatcher(folder_path)
+
+
+def _set_files_df(df):
+    st.session_state.df = df
+    metadata.save_snapshot(df, DOWNLOADS_PATH)
+
+
+# Files the source doesn't have a value for keep the one they have
+def _merge_by_path(df, source_df, columns):
+    df = df.copy()
+    source_df = source_df.drop_duplicates('Path').set_index('Path')
+
+    for column in columns:
+        if column not in source_df.columns:
+            continue
+
+        values = df['Path'].map(source_df[column])
+        df[column] = values.fillna(df[column]) if column in df.columns else values
+
+    return df
+
+
+def _paginate(num_items: int, key: str, page_size: int) -> slice:
+    num_pages = max(1, -(-num_items // page_size))
+    if num_pages == 1:
+        return slice(0, num_items)
+
+    page = st.number_input(f"Page (of {num_pages}, {num_items:,} files)", min_value=1, max_value=num_pages,
+                           value=1, key=f"{key}_page")
+    return slice((page - 1) * page_size, page * page_size)
 
 
 class LLMFileOrganizer:
     def __init__(self):
-        self.df = st.session_state.get("df", metadata.get_files_metadata(DOWNLOADS_PATH))
+        self.df = _get_files_df()
 
     def run(self):
         st.set_page_config(page_title="LLM File Manager")
@@ -54,7 +224,11 @@ class LLMFileOrganizer:
 
     def _overview(self):
         st.write("This table shows all files in your Downloads folder with metadata.")
-        st.dataframe(self.df[['Filename', 'Type', 'Size', 'Last Modified']])
+        if st.button("Refresh", key="refresh_button"):
+            self.df = _get_files_df(force_refresh=True)
+
+        page = _paginate(len(self.df), "overview", TABLE_PAGE_SIZE)
+        st.dataframe(self.df.iloc[page][['Filename', 'Type', 'Size', 'Last Modified']])
 
     def _categorize(self):
         st.write("Use the LLM to categorize files into directories.")
@@ -62,52 +236,29 @@ class LLMFileOrganizer:
         user_input = st.text_area("Enter custom categories (one per line)", height=100)
         user_categories = [line.strip() for line in user_input.splitlines() if line.strip()] or None
 
-        if "run_categorization_flag" not in st.session_state:
-            st.session_state.run_categorization_flag = False
-
         if "categorized_df" not in st.session_state:
             st.session_state.categorized_df = None
 
-        if st.button("Run Categorization", disabled=st.session_state.run_categorization_flag,
+        job = _get_job("categorize")
+        if st.button("Run Categorization", disabled=job is not None and job.status in jobs.ACTIVE_STATUSES,
                      key="run_categorization_button"):
-            st.session_state.run_categorization_flag = True
-            st.session_state.categorized_df = None
-
-            progress_text = st.empty()
-            progress_bar = st.progress(0)
-
-            def keyword_progress_callback(i, total):
-                progress_text.markdown(f"Generating file keywords: **{i}/{total}**")
-                progress_bar.progress(i / total)
-
-            callback = _stream_callback_factory()
-            categorized_df = categorize.categorize(
-                self.df,
-                user_categories=user_categories,
-                stream_callback=callback,
-                progress_callback=keyword_progress_callback
-            )
-            st.session_state.categorized_df = categorized_df
-            st.session_state.run_categorization_flag = False
-            st.session_state.df = categorized_df
-            self.df = categorized_df
-            st.rerun()
+            _submit_job("categorize", _categorize_job, self.df.copy(), user_categories)
+        _show_job(job)
 
-        if "last_thinking" in st.session_state and st.session_state.last_thinking:
-            with st.expander("### Thinking...", expanded=True):
-                st.markdown(
-                    f"<div style='color: gray; font-size: 0.9em;'>{st.session_state.last_thinking}</div>",
-                    unsafe_allow_html=True
-                )
-
-        if "last_response" in st.session_state and st.session_state.last_response:
-            st.markdown("### Response\n" + st.session_state.last_response)
+        categorized_df = _take_job_result(job)
+        if categorized_df is not None:
+            # Files may have been added, moved or deleted since the job started, possibly in an earlier session, so
+            # its keywords and categories go into the current files instead of replacing them
+            self.df = _merge_by_path(self.df, categorized_df, ['Keywords', 'LLM-Categorized'])
+            st.session_state.categorized_df = self.df
+            _set_files_df(self.df)
 
         if st.session_state.categorized_df is not None:
             st.markdown("### Categorized Files")
             categorized_df = st.session_state.categorized_df
+            page = _paginate(len(categorized_df), "categorized", TABLE_PAGE_SIZE)
             edited_subset = st.data_editor(
-                categorized_df[['Filename', 'Keywords', 'LLM-Categorized']],
+                categorized_df.iloc[page][['Filename', 'Keywords', 'LLM-Categorized']],
                 disabled=['Filename'],
                 num_rows="dynamic",
                 use_container_width=True
@@ -116,9 +267,26 @@ class LLMFileOrganizer:
             st.session_state.categorized_df = categorized_df
             self.df = categorized_df
 
+            dry_run = st.checkbox("Dry run (only show what would be moved)", key="organize_dry_run")
+
             if st.button("Organize Into Folders"):
-                file_interaction.move_to_category_folders(categorized_df)
-                st.success("Files moved into category folders.")
+                result = file_interaction.move_to_category_folders(categorized_df, dry_run=dry_run)
+                if dry_run:
+                    st.dataframe([{"From": source, "To": target} for source, target in result.moved])
+                else:
+                    st.success(f"{len(result.moved)} files moved into category folders.")
+                    st.session_state.last_move_journal = result.journal_path
+                if result.plan.renamed:
+                    st.info(f"{len(result.plan.renamed)} files were renamed to avoid overwriting existing files.")
+                for path, error in result.failed.items():
+                    st.error(f"Failed to move {path}: {error}")
+
+            if st.session_state.get("last_move_journal") and st.button("Undo Organize"):
+                result = file_interaction.undo_moves(st.session_state.last_move_journal)
+                st.success(f"{len(result.moved)} files moved back.")
+                for path, error in result.failed.items():
+                    st.error(f"Failed to move back {path}: {error}")
+                del st.session_state.last_move_journal
 
     def _suggest_deletions(self):
         col1, col2, col3, col4, _ = st.columns([1, 1, 1, 1, 2])
@@ -138,57 +306,83 @@ class LLMFileOrganizer:
         max_size_kb = max_size * size_multipliers[size_unit]
         max_age_days = max_age * age_multipliers[age_unit]
 
-        if "get_suggestions_flag" not in st.session_state:
-            st.session_state.get_suggestions_flag = False
-
-        if st.button("Get Suggestions", disabled=st.session_state.get_suggestions_flag, key="get_suggestions_button"):
-            st.session_state.get_suggestions_flag = True
-            st.rerun()
+        job = _get_job("suggest_deletions")
+        if st.button("Get Suggestions", disabled=job is not None and job.status in jobs.ACTIVE_STATUSES,
+                     key="get_suggestions_button"):
+            _submit_job("suggest_deletions", _suggest_deletions_job, self.df.copy(), max_age_days, max_size_kb)
+        _show_job(job)
 
-        if "last_thinking" in st.session_state and st.session_state.last_thinking:
-            with st.expander("### Thinking...", expanded=True):
-                st.markdown(
-                    f"<div style='color: gray; font-size: 0.9em;'>{st.session_state.last_thinking}</div>",
-                    unsafe_allow_html=True
-                )
-
-        if "last_response" in st.session_state and st.session_state.last_response:
-            st.markdown("### Response\n" + st.session_state.last_response)
+        suggestions = _take_job_result(job)
+        if suggestions is not None:
+            st.session_state.suggestions = suggestions
+            st.session_state.pop("deletion_checkboxes", None)
 
-        if "suggestions" in st.session_state and not st.session_state.get_suggestions_flag:
+        if "suggestions" in st.session_state:
             st.write("### Files Suggested for Deletion:")
             if "deletion_checkboxes" not in st.session_state:
                 st.session_state.deletion_checkboxes = {
                     file_name: True for file_name in st.session_state.suggestions
                 }
 
-            selected_files = []
-            for file_name, reason in st.session_state.suggestions.items():
-                checked = st.checkbox(f"**{file_name}**: {reason}",
-                                      value=st.session_state.deletion_checkboxes.get(file_name, True),
-                                      key=f"del_cb_{file_name}")
+            select_col, clear_col, _ = st.columns([1, 1, 4])
+            with select_col:
+                if st.button("Select all", key="select_all_deletions"):
+                    st.session_state.deletion_checkboxes = dict.fromkeys(st.session_state.suggestions, True)
+            with clear_col:
+                if st.button("Select none", key="select_no_deletions"):
+                    st.session_state.deletion_checkboxes = dict.fromkeys(st.session_state.suggestions, False)
+
+            # Only one page of checkboxes is rendered; the choices for every file live in deletion_checkboxes. The
+            # current choice is part of the key so "Select all/none" also updates checkboxes that were rendered before
+            suggestions = list(st.session_state.suggestions.items())
+            for file_name, reason in suggestions[_paginate(len(suggestions), "deletions", CHECKBOX_PAGE_SIZE)]:
+                was_checked = st.session_state.deletion_checkboxes.get(file_name, True)
+                checked = st.checkbox(f"**{file_name}**: {reason}", value=was_checked,
+                                      key=f"del_cb_{file_name}_{was_checked}")
                 st.session_state.deletion_checkboxes[file_name] = checked
-                if checked:
-                    selected_files.append(file_name)
+
+            selected_files = [file_name for file_name, checked in st.session_state.deletion_checkboxes.items()
+                              if checked]
+
+            use_quarantine = st.checkbox(
+                f"Quarantine (restorable for {file_interaction.QUARANTINE_RETENTION_DAYS} days) instead of trash",
+                value=True, key="use_quarantine")
 
             if st.button("Delete Suggested Files", key="delete_suggested_button") and selected_files:
                 paths = [os.path.join(DOWNLOADS_PATH, file_name) for file_name in selected_files]
-                file_interaction.delete_suggested_files(paths)
+                file_interaction.delete_suggested_files(paths, quarantine=use_quarantine)
                 st.success("Selected files deleted.")
                 del st.session_state.suggestions
                 del st.session_state.deletion_checkboxes
 
-        if st.session_state.get_suggestions_flag:
-            with st.spinner("Analyzing metadata..."):
-                callback = _stream_callback_factory()
-                suggestions_df = suggest_deletions.suggest_deletions(self.df, max_age_days, max_size_kb,
-                                                                     stream_callback=callback)
-                suggestions_df = suggestions_df[suggestions_df['LLM-Delete'] == 'Delete']
-                suggestions = {row['Filename']: row['LLM-Delete-Reason'] for _, row in suggestions_df.iterrows()}
-
-            st.session_state.get_suggestions_flag = False
-            st.session_state.suggestions = suggestions
-            st.rerun()
+        self._quarantine()
+
+    def _quarantine(self):
+        quarantine = file_interaction.get_quarantine()
+        items = quarantine.get_items()
+        if items.empty:
+            return
+
+        with st.expander(f"Quarantined files ({len(items)})"):
+            selected_ids = st.multiselect("Files to restore", options=items['Id'].tolist(),
+                                          format_func=dict(zip(items['Id'], items['Filename'])).get,
+                                          key="restore_ids")
+            st.dataframe(items[['Filename', 'Original Path', 'Quarantined', 'Purge After']],
+                         use_container_width=True)
+
+            col1, col2 = st.columns(2)
+            with col1:
+                if st.button("Restore Selected", disabled=not selected_ids, key="restore_selected_button"):
+                    restored, failed = quarantine.restore(selected_ids)
+                    st.success(f"{len(restored)} files restored.")
+                    for path, error in failed.items():
+                        st.error(f"Failed to restore {path}: {error}")
+            with col2:
+                if st.button("Restore All", key="restore_all_button"):
+                    restored, failed = quarantine.restore()
+                    st.success(f"{len(restored)} files restored.")
+                    for path, error in failed.items():
+                        st.error(f"Failed to restore {path}: {error}")
 
     def _search_files(self):
         outer_col = st.container()
@@ -200,25 +394,20 @@ class LLMFileOrganizer:
             with input_col2:
                 max_num_results = st.number_input("Max number of results", min_value=1, value=5, key="max_num_results")
 
-            if "search_triggered" not in st.session_state:
-                st.session_state.search_triggered = False
+            job = _get_job("search")
+            if st.button("Search", disabled=job is not None and job.status in jobs.ACTIVE_STATUSES,
+                         key="search_button"):
+                _submit_job("search", _search_job, self.df.copy(), query, max_num_results)
+            _show_job(job)
 
-            if st.button("Search", disabled=st.session_state.search_triggered, key="search_button"):
-                st.session_state.search_triggered = True
-                st.rerun()
-
-            if st.session_state.search_triggered:
-                with st.spinner("Searching files..."):
-                    callback = _stream_callback_factory()
-                    results = search.search(self.df,
-                                            st.session_state.search_query,
-                                            st.session_state.max_num_results,
-                                            stream_callback=callback)
-
-                st.session_state.search_triggered = False
+            search_results = _take_job_result(job)
+            if search_results is not None:
+                st.session_state.search_results = search_results
 
+            if "search_results" in st.session_state:
+                query, results = st.session_state.search_results
                 if results:
-                    st.write(f"### Search Results for '{st.session_state.search_query}':")
+                    st.write(f"### Search Results for '{query}':")
                     for file_name in results:
                         file_path = os.path.join(DOWNLOADS_PATH, file_name)
                         st.code(file_path, language='text')
@@ -226,7 +415,13 @@ class LLMFileOrganizer:
                     st.warning("No files found matching your query.")
 
 
+@st.cache_resource(show_spinner=False)
+def _warm_up_models():
+    llm_interaction.warm_up(background=True)
+
+
 def main():
+    _warm_up_models()
     app = LLMFileOrganizer()
     app.run()
 